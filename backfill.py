@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pandas import DataFrame, Timestamp
+
+from prices import AlpacaBackend, ReplayBackend, SyntheticBackend, BarStore, CHUNKS, parse_interval, to_ns
+from prices.store import frame_to_arrays
+
+
+NEWS_CHUNK = timedelta(days=30)
+
+_backend = None
+_rest = None
+
+
+def make_backend(options:dict):
+
+    if options['backend'] == 'synthetic':
+        return SyntheticBackend(seed=options['seed'])
+
+    if options['backend'] == 'replay':
+        return ReplayBackend(options['replay_dir'], options['replay_format'])
+
+    return AlpacaBackend(options['api_key'], options['api_secret'])
+
+
+def init_worker(options:dict):
+
+    global _backend, _rest
+
+    _backend = make_backend(options)
+
+    if options['news']:
+        from alpaca_trade_api.rest import REST
+        _rest = REST(options['api_key'], options['api_secret'])
+
+
+def fetch_prices(symbols:list, start:int, end:int, interval:str):
+
+    frames = _backend.fetch(symbols, start, end, interval)
+
+    # Plain arrays are much cheaper than DataFrames to send back from a worker process
+    return {symbol: frame_to_arrays(df) for symbol, df in frames.items()}
+
+
+def fetch_news(symbol:str, start:int, end:int):
+
+    news = _rest.get_news(symbol,
+                          start = Timestamp(start, tz='UTC').isoformat(),
+                          end = Timestamp(end, tz='UTC').isoformat(),
+                          limit = 100000)
+
+    return [{
+        'id': new.id,
+        'url': new.url,
+        'headline': new.headline,
+        'symbols': new.symbols,
+        'created_at': str(new.created_at)
+    } for new in news]
+
+
+class Manifest:
+
+    def __init__(self, path:str):
+
+        self.path = path
+        self.completed = set()
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.completed = set(json.load(file)['completed'])
+
+
+    def __contains__(self, key:str):
+
+        return key in self.completed
+
+
+    def add(self, key:str):
+
+        self.completed.add(key)
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'completed': sorted(self.completed)}, file)
+
+        os.replace(tmp, self.path)
+
+
+def windows(start:int, end:int, chunk:int, clip:bool = True):
+
+    first = start - start % chunk
+
+    # Unclipped windows are the same whole chunks PricesClient requests, so the two share coverage
+    return [(max(x, start) if clip else x, min(x + chunk, end)) for x in range(first, end, chunk)]
+
+
+def backfill(options:dict):
+
+    # The same directory PricesClient opens for this backend with resample off
+    source = make_backend(options).source
+    store = BarStore(options['cache_dir'], source)
+    manifest = Manifest(os.path.join(options['cache_dir'], 'backfill.json'))
+
+    start = to_ns(options['start'])
+    end = min(to_ns(options['end']), to_ns(Timestamp.now(tz='UTC')))
+
+    symbols = options['symbols']
+    batches = [symbols[x:x + options['batch']] for x in range(0, len(symbols), options['batch'])]
+
+    tasks = []
+
+    for interval in options['intervals']:
+
+        _, unit = parse_interval(interval)
+
+        for window_start, window_end in windows(start, end, CHUNKS[unit], clip=False):
+            for batch in batches:
+
+                key = f'prices|{source}|{interval}|{",".join(batch)}|{window_start}|{window_end}'
+
+                if key in manifest:
+                    continue
+
+                missing = [symbol for symbol in batch if store.missing(symbol, interval, window_start, window_end)]
+
+                if missing:
+                    tasks.append((key, 'prices', (missing, window_start, window_end, interval)))
+
+    if options['news']:
+
+        news_chunk = int(NEWS_CHUNK.total_seconds() * 1e9)
+
+        for symbol in symbols:
+            for window_start, window_end in windows(start, end, news_chunk):
+
+                key = f'news|{symbol}|{window_start}|{window_end}'
+
+                if key not in manifest:
+                    tasks.append((key, 'news', (symbol, window_start, window_end)))
+
+    print(f'{len(tasks)} chunks da scaricare, {len(manifest.completed)} gia\' completati')
+
+    executor_class = ProcessPoolExecutor if options['processes'] else ThreadPoolExecutor
+
+    bars = 0
+    articles = 0
+    failed = []
+    started = time.perf_counter()
+
+    with executor_class(max_workers=options['workers'], initializer=init_worker, initargs=(options,)) as executor:
+
+        futures = {
+            executor.submit(fetch_prices if kind == 'prices' else fetch_news, *arguments): (key, kind, arguments)
+            for key, kind, arguments in tasks
+        }
+
+        # Workers only download, every write to the store and the manifest happens here
+        for n, future in enumerate(as_completed(futures), 1):
+
+            key, kind, arguments = futures[future]
+
+            # A failed chunk stays out of the manifest, the next run downloads it again
+            try:
+                result = future.result()
+
+            except Exception as error:
+                failed.append(key)
+                print(f'[{n}/{len(tasks)}] {key} non scaricato: {error!r}', file=sys.stderr, flush=True)
+                continue
+
+            if kind == 'prices':
+
+                symbols_batch, window_start, window_end, interval = arguments
+
+                for symbol in symbols_batch:
+                    data = result.get(symbol)
+
+                    if data is not None:
+                        bars += len(data[0])
+
+                    store.write(symbol, interval, data if data is not None else DataFrame(), window_start, window_end)
+
+            else:
+
+                symbol, window_start, window_end = arguments
+                directory = os.path.join(options['cache_dir'], 'news', symbol)
+                os.makedirs(directory, exist_ok=True)
+
+                with open(os.path.join(directory, f'{window_start}_{window_end}.json'), 'w') as file:
+                    json.dump(result, file)
+
+                articles += len(result)
+
+            manifest.add(key)
+
+            elapsed = time.perf_counter() - started
+            print(f'[{n}/{len(tasks)}] {bars / elapsed:.0f} bars/s, {articles / elapsed:.1f} articles/s', flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(f'Completato in {elapsed:.1f}s: {bars} barre, {articles} articoli')
+
+    if failed:
+        print(f'{len(failed)} chunk non scaricati, verranno ripresi alla prossima esecuzione', file=sys.stderr)
+
+    return failed
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Scarica in anticipo lo storico di prezzi e notizie')
+
+    parser.add_argument('--symbols', nargs='+', required=True)
+    parser.add_argument('--start', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--end', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--intervals', nargs='+', default=['1h'])
+    parser.add_argument('--cache-dir', default='data')
+
+    parser.add_argument('--backend', choices=['alpaca', 'replay', 'synthetic'], default='alpaca')
+    parser.add_argument('--api-key', default=os.environ.get('APCA_API_KEY_ID'))
+    parser.add_argument('--api-secret', default=os.environ.get('APCA_API_SECRET_KEY'))
+    parser.add_argument('--replay-dir')
+    parser.add_argument('--replay-format', choices=['parquet', 'csv'], default='parquet')
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--news', action='store_true')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--processes', action='store_true')
+
+    return vars(parser.parse_args())
+
+
+if __name__ == '__main__':
+    sys.exit(1 if backfill(parse_args()) else 0)
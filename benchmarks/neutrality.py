@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'pieces')]
+
+from prices import PricesClient, SyntheticBackend
+from prices.sessions import TradingCalendar
+from Timeline import EpisodeTimeline
+
+
+def delta_prices(client:PricesClient, timeline:EpisodeTimeline, cursor:int, streak:int):
+
+    # What _step did before: fetch the streak's days and scan the slice in Python
+    prices = client.get_delta_prices(timeline.symbol, timeline.calendar[cursor], timedelta(1) * streak, '1h')['close']
+
+    # default only because a streak of k steps can span fewer than k bars over a weekend
+    return min(prices.values[len(prices) - streak - 1:-1], default=None)
+
+
+def sparse_table(client:PricesClient, timeline:EpisodeTimeline, cursor:int, streak:int):
+
+    return timeline.range_min(cursor - streak, cursor)
+
+
+def run(method, client:PricesClient, timeline:EpisodeTimeline, streak:int, repeat:int):
+
+    cursors = range(streak + 1, len(timeline), max((len(timeline) - streak - 1) // repeat, 1))
+
+    started = time.perf_counter()
+
+    for cursor in cursors:
+        method(client, timeline, cursor, streak)
+
+    return (time.perf_counter() - started) / len(cursors)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Confronta il calcolo del minimo della neutralita\'')
+    parser.add_argument('--streaks', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    client = PricesClient(cache_dir=tempfile.mkdtemp(), backend=SyntheticBackend(seed=0))
+    calendar = TradingCalendar(datetime(2020, 1, 1), datetime(2023, 1, 1))
+    timeline = EpisodeTimeline(client, 'AAPL', calendar)
+
+    print(f'{"streak":>8} {"get_delta_prices":>18} {"sparse table":>14} {"speedup":>9}')
+
+    for streak in args.streaks:
+
+        before = run(delta_prices, client, timeline, streak, args.repeat)
+        after = run(sparse_table, client, timeline, streak, args.repeat)
+
+        print(f'{streak:>8} {before * 1e6:>15.1f} us {after * 1e6:>11.2f} us {before / after:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
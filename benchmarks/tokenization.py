@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'pieces')]
+
+import tensorflow as tf
+
+from transformers import AutoTokenizer
+from Observation import tokenize_news
+
+
+def per_article(tokenizer, titles:list, paragraphs:list):
+
+    # What Observer did before: one tf tokenizer call per title and per article, then pad_sequences
+    def title(x):
+
+        return tf.keras.preprocessing.sequence.pad_sequences(
+                        tokenizer(x, return_tensors='tf')['input_ids'],
+                        maxlen=100)[0]
+
+    def paragraph(x):
+
+        return tf.keras.preprocessing.sequence.pad_sequences(
+                        tokenizer(x or [tokenizer.pad_token], padding=True, truncation=True, return_tensors='tf')['input_ids'],
+                        maxlen=512)[0]
+
+    return np.array([title(x) for x in titles], np.int32), np.array([paragraph(x) for x in paragraphs], np.int32)
+
+
+def articles(vocab:list, count:int, rng:np.random.Generator):
+
+    def text(words):
+        return ' '.join(rng.choice(vocab, words))
+
+    titles = [text(rng.integers(5, 20)) for _ in range(count)]
+    paragraphs = [[text(rng.integers(20, 120)) for _ in range(rng.integers(3, 15))] for _ in range(count)]
+
+    return titles, paragraphs
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Confronta la tokenizzazione articolo per articolo con quella a batch')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--articles', type=int, nargs='+', default=[10, 30, 300])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+    tokenizer.padding_side = 'left'
+
+    vocab = [word for word in tokenizer.get_vocab() if word.isalpha()]
+    rng = np.random.default_rng(0)
+
+    print(f'{"articles":>9} {"per article":>14} {"batched":>12} {"speedup":>9} {"same titles":>12}')
+
+    for count in args.articles:
+
+        titles, paragraphs = articles(vocab, count, rng)
+
+        timings = []
+        results = []
+
+        for method in (per_article, tokenize_news):
+
+            started = time.perf_counter()
+
+            for _ in range(args.repeat):
+                out = method(tokenizer, titles, paragraphs)
+
+            timings.append((time.perf_counter() - started) / args.repeat)
+            results.append(out)
+
+        same = np.array_equal(results[0][0], results[1][0])
+
+        print(f'{count:>9} {timings[0] * 1e3:>11.1f} ms {timings[1] * 1e3:>9.2f} ms {timings[0] / timings[1]:>8.0f}x {str(same):>12}')
+
+
+if __name__ == '__main__':
+    main()
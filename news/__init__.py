@@ -1,5 +1,9 @@
 try:
     from bezinga.scripts.scraper import GetNews
+    from bezinga.scripts.index import NewsIndex
+    from bezinga.scripts.articles import ArticleStore
 
 except ImportError:
     from news.bezinga.scripts.scraper import GetNews
+    from news.bezinga.scripts.index import NewsIndex
+    from news.bezinga.scripts.articles import ArticleStore
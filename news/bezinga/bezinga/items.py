@@ -10,3 +10,4 @@ class BezingaItem(scrapy.Item):
     title = scrapy.Field()
     symbols = scrapy.Field()
     paragraphs = scrapy.Field()
+    url = scrapy.Field()
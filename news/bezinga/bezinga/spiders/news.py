@@ -45,7 +45,7 @@ class NewsSpider(scrapy.Spider):
             symbol = self.symbols[i]
             yield Request(url, 
                           headers={'User-Agent': user_agent}, 
-                          meta={'symbol': symbol}, 
+                          meta={'symbol': symbol, 'url': url}, 
                           callback=self.parse)
 
     def togli(self, stringa):
@@ -77,5 +77,6 @@ class NewsSpider(scrapy.Spider):
         books['title'] = title
         books['symbols'] = symbol
         books['paragraphs'] = text
+        books['url'] = response.meta['url']
 
         yield books
@@ -0,0 +1,90 @@
+import json
+import time
+import zlib
+import sqlite3
+
+
+class ArticleStore:
+
+    def __init__(self, path:str = ':memory:', compress:bool = False):
+
+        self.path = path
+        self.compress = compress
+
+        # Several envs, even in different processes, may share the same file
+        self._connection = sqlite3.connect(path, timeout=60)
+
+        if path != ':memory:':
+            self._connection.execute('PRAGMA journal_mode=WAL')
+
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS articles (
+                url TEXT PRIMARY KEY,
+                title TEXT,
+                paragraphs BLOB NOT NULL,
+                compressed INTEGER NOT NULL,
+                symbols TEXT NOT NULL,
+                fetched_at INTEGER NOT NULL
+            )
+        ''')
+        self._connection.commit()
+
+
+    def __len__(self):
+
+        return self._connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+
+    def __contains__(self, url:str):
+
+        return self._connection.execute('SELECT 1 FROM articles WHERE url = ?', (url,)).fetchone() is not None
+
+
+    def get(self, urls:list):
+
+        found = dict()
+        urls = list(dict.fromkeys(urls))
+
+        # SQLite limits the number of parameters of a single query
+        for start in range(0, len(urls), 500):
+
+            batch = urls[start:start + 500]
+            rows = self._connection.execute(
+                f'SELECT url, title, paragraphs, compressed, symbols FROM articles '
+                f'WHERE url IN ({",".join("?" * len(batch))})', batch)
+
+            for url, title, paragraphs, compressed, symbols in rows:
+
+                paragraphs = zlib.decompress(paragraphs) if compressed else paragraphs
+
+                found[url] = {
+                    'title': title,
+                    'symbols': json.loads(symbols),
+                    'paragraphs': json.loads(paragraphs),
+                    'url': url
+                }
+
+        return found
+
+
+    def put(self, items:list):
+
+        rows = []
+        fetched_at = time.time_ns()
+
+        for item in items:
+
+            if not item.get('url'):
+                continue
+
+            paragraphs = json.dumps(item.get('paragraphs') or []).encode()
+
+            rows.append((item['url'],
+                         item.get('title'),
+                         zlib.compress(paragraphs) if self.compress else paragraphs,
+                         int(self.compress),
+                         json.dumps(item.get('symbols') or []),
+                         fetched_at))
+
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)', rows)
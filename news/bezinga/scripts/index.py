@@ -0,0 +1,236 @@
+import os
+import json
+import glob
+import sqlite3
+import numpy as np
+
+from datetime import datetime, timedelta
+from pandas import Timestamp
+
+from prices.store import Coverage, to_ns
+
+
+# Alpaca has no articles before this date, a search never has to go further back
+NEWS_START = datetime(2015, 1, 1)
+
+
+class NewsIndex:
+
+    def __init__(self, directory:str | None = None):
+
+        self.directory = directory
+
+        self._articles = dict()
+        self._postings = dict()
+        self._seq = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        # Shared by every process with the same cache_dir, each one keeps its own sorted copy in memory
+        self._connection = sqlite3.connect(os.path.join(directory, 'index.sqlite') if directory is not None else ':memory:',
+                                           timeout = 60,
+                                           isolation_level = None)
+
+        if directory is not None:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS articles (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER UNIQUE NOT NULL,
+                url TEXT NOT NULL,
+                symbols TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS coverage (
+                symbol TEXT NOT NULL,
+                start_ns INTEGER NOT NULL,
+                end_ns INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS coverage_symbol ON coverage (symbol);
+            CREATE TABLE IF NOT EXISTS imported (
+                path TEXT PRIMARY KEY
+            );
+        ''')
+
+        if directory is not None:
+            self._import_backfill()
+
+        self._refresh()
+
+
+    def __len__(self):
+
+        self._refresh()
+
+        return len(self._articles)
+
+
+    def _import_backfill(self):
+
+        imported = {path for path, in self._connection.execute('SELECT path FROM imported')}
+
+        # The files backfill.py --news writes next to the index, <symbol>/<start>_<end>.json
+        for path in sorted(glob.glob(os.path.join(self.directory, '*', '*.json'))):
+
+            name = os.path.relpath(path, self.directory)
+
+            if name in imported:
+                continue
+
+            symbol = os.path.basename(os.path.dirname(path))
+            start, end = map(int, os.path.splitext(os.path.basename(path))[0].split('_'))
+
+            with open(path, 'r') as file:
+                self._commit(symbol, json.load(file), start, end, name)
+
+
+    def _coverage(self, symbol:str):
+
+        return Coverage(sorted(self._connection.execute(
+            'SELECT start_ns, end_ns FROM coverage WHERE symbol = ?', (symbol,)).fetchall()))
+
+
+    def _commit(self, symbol:str, articles:list, start:int, end:int, imported:str | None = None):
+
+        rows = [(int(article['id']),
+                 article['url'],
+                 json.dumps(list(article['symbols'])),
+                 to_ns(article['created_at'])) for article in articles]
+
+        # Articles before coverage in the same transaction, a reader that sees a range covered also sees its articles
+        self._connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO articles (id, url, symbols, created_at) VALUES (?, ?, ?, ?)', rows)
+
+            # Merged with what other processes covered meanwhile, the table keeps only the merged ranges
+            coverage = self._coverage(symbol)
+            coverage.add(start, end)
+
+            self._connection.execute('DELETE FROM coverage WHERE symbol = ?', (symbol,))
+            self._connection.executemany('INSERT INTO coverage VALUES (?, ?, ?)',
+                                         [(symbol, x, y) for x, y in coverage.ranges])
+
+            if imported is not None:
+                self._connection.execute('INSERT OR IGNORE INTO imported VALUES (?)', (imported,))
+
+            self._connection.execute('COMMIT')
+
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+
+
+    def _refresh(self):
+
+        # Only the rows added since the last refresh, by this process or any other
+        rows = self._connection.execute(
+            'SELECT seq, id, url, symbols, created_at FROM articles WHERE seq > ? ORDER BY seq', (self._seq,)).fetchall()
+
+        if not rows:
+            return
+
+        added = dict()
+
+        for seq, article_id, url, symbols, created_at in rows:
+
+            article = {'id': article_id, 'url': url, 'symbols': json.loads(symbols), 'created_at': created_at}
+            self._articles[article_id] = article
+
+            for symbol in article['symbols']:
+                added.setdefault(symbol, []).append((created_at, article_id))
+
+        # Merged into each sorted posting list, nothing already there is sorted again
+        for symbol, new in added.items():
+
+            new.sort()
+            times, ids = self._postings.get(symbol, (np.empty(0, np.int64), np.empty(0, np.int64)))
+            new_times = np.array([x[0] for x in new], dtype=np.int64)
+            new_ids = np.array([x[1] for x in new], dtype=np.int64)
+
+            positions = np.searchsorted(times, new_times, side='left')
+            ties = np.searchsorted(times, new_times, side='right')
+
+            # Articles published in the same instant are kept ordered by id, whichever process added them
+            for i in np.flatnonzero(ties > positions):
+                positions[i] += np.count_nonzero(ids[positions[i]:ties[i]] < new_ids[i])
+
+            self._postings[symbol] = (np.insert(times, positions, new_times), np.insert(ids, positions, new_ids))
+
+        self._seq = rows[-1][0]
+
+
+    def _before(self, symbol:str, date:int, nums:int):
+
+        times, ids = self._postings.get(symbol, (np.empty(0, np.int64), np.empty(0, np.int64)))
+        end = np.searchsorted(times, date, side='right')
+
+        return times[max(end - nums, 0):end], ids[max(end - nums, 0):end]
+
+
+    def latest(self, symbol:str | list, date:datetime, nums:int, per_symbol:bool = False):
+
+        self._refresh()
+
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        parts = [self._before(x, to_ns(date), nums) for x in symbols]
+
+        if len(parts) == 1:
+            ids = parts[0][1]
+
+        else:
+            # At most nums rows per symbol, an article about several of them is kept once
+            times = np.concatenate([x[0] for x in parts])
+            ids = np.concatenate([x[1] for x in parts])
+            ids, first = np.unique(ids, return_index=True)
+            ids = ids[np.lexsort((ids, times[first]))]
+
+        # Newest first, the order Alpaca returns them in; per_symbol keeps the latest nums of every symbol
+        ids = ids[::-1] if per_symbol else ids[::-1][:nums]
+
+        return [self._articles[int(x)] for x in ids]
+
+
+    def update(self, rest, symbol:str | list, date:datetime, nums:int):
+
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+
+        # Nothing after the present can be covered, it may still be published
+        end = min(to_ns(date), to_ns(Timestamp.now(tz='UTC')))
+        floor = to_ns(NEWS_START)
+
+        for symbol in symbols:
+
+            delta = max(int(timedelta(days=nums / 5).total_seconds() * 1e9), 1)
+
+            while True:
+
+                start = max(end - delta, floor)
+
+                # Only the parts of the window never asked for go to the API
+                for gap_start, gap_end in self._coverage(symbol).missing(start, end):
+
+                    news = rest.get_news(symbol,
+                                         start = Timestamp(gap_start, tz='UTC').isoformat(),
+                                         end = Timestamp(gap_end, tz='UTC').isoformat(),
+                                         limit = 100000)
+
+                    self._commit(symbol, [{
+                        'id': new.id,
+                        'url': new.url,
+                        'symbols': new.symbols,
+                        'created_at': str(new.created_at)
+                    } for new in news], gap_start, gap_end)
+
+                self._refresh()
+
+                times, _ = self._postings.get(symbol, (np.empty(0, np.int64), None))
+                count = np.searchsorted(times, end, side='right') - np.searchsorted(times, start, side='left')
+
+                if count >= nums or start <= floor:
+                    break
+
+                delta *= 2
@@ -1,6 +1,7 @@
 import os
 
 import subprocess
+import tempfile
 import json
 import inspect
 
@@ -8,6 +9,14 @@ from collections.abc import Callable
 from datetime import datetime, timedelta
 from alpaca_trade_api.rest import REST
 
+try:
+    from bezinga.scripts.index import NewsIndex
+    from bezinga.scripts.articles import ArticleStore
+
+except ImportError:
+    from news.bezinga.scripts.index import NewsIndex
+    from news.bezinga.scripts.articles import ArticleStore
+
 
 def get_calling_file_directory():
     
@@ -21,10 +30,17 @@ def get_calling_file_directory():
 
 class GetNews:
 
-    def __init__(self, api_key, secret_key):
+    def __init__(self, api_key, secret_key, cache_dir:str | None = None, compress_articles:bool = False):
 
         self.rest = REST(api_key, secret_key)
 
+        # Same directory backfill.py --news writes to, its articles are imported into the index
+        self.index = NewsIndex(os.path.join(cache_dir, 'news') if cache_dir is not None else None)
+
+        # Every url is crawled once, then served from here
+        self.articles = ArticleStore(os.path.join(cache_dir, 'news', 'articles.sqlite') if cache_dir is not None else ':memory:',
+                                     compress_articles)
+
     
 
     def __preprocess_links_symbols(self, links:list, symbols:list):
@@ -53,25 +69,43 @@ class GetNews:
 
     def get_news_by_link(self, links, symbols):
 
-        global_dir = os.getcwd()
+        if len(links) != len(symbols):
+            raise ValueError('I Simboli devono essere quanti i link')
+
+        found = self.articles.get(links)
+        missing = [(link, symbol) for link, symbol in zip(links, symbols) if link not in found]
+
+        if missing:
+            missing = dict(missing)
 
-        directory_in = get_calling_file_directory()
-        directory_out = os.path.abspath(os.path.join(directory_in, '../bezinga'))
-        os.chdir(directory_out)
+            crawled = self.crawl(list(missing.keys()), list(missing.values()))
+            self.articles.put(crawled)
+
+            found.update({item['url']: item for item in crawled if item.get('url')})
+
+        # In the order of the links, the ones the crawl could not read are left out
+        return [found[link] for link in dict.fromkeys(links) if link in found]
+
+
+
+    def crawl(self, links, symbols):
+
+        directory = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../bezinga'))
 
         prep_links, prep_symbols = self.__preprocess_links_symbols(links, symbols)
 
-        subprocess.call(['scrapy', 'crawl', 'news', 
-                        '-a', f'start={prep_links}', 
-                        '-a', f'symbols={prep_symbols}',
-                        '-O', f'{os.path.join(directory_in, "output.json")}:json'], shell=True)
-        
-        os.chdir(directory_in)
+        # Every call has its own output file and never changes the working directory, crawls may run concurrently
+        with tempfile.TemporaryDirectory() as output_dir:
 
-        with open('output.json', 'r', encoding='utf-8') as file:
-            out = json.load(file)
+            output = os.path.join(output_dir, 'output.json')
 
-        os.chdir(global_dir)
+            subprocess.run(['scrapy', 'crawl', 'news', 
+                            '-a', f'start={prep_links}', 
+                            '-a', f'symbols={prep_symbols}',
+                            '-O', f'{output}:json'], cwd=directory, check=True)
+
+            with open(output, 'r', encoding='utf-8') as file:
+                out = json.load(file)
 
         return out  
     
@@ -148,11 +182,13 @@ class GetNews:
 
                     symbols_news[symbol] = {
                         'title': [],
-                        'paragraphs': []
+                        'paragraphs': [],
+                        'url': []
                     }
                 
                 symbols_news[symbol]['title'].append(processed_title)
                 symbols_news[symbol]['paragraphs'].append(processed_paragraphs)
+                symbols_news[symbol]['url'].append(item.get('url'))
                    
         return symbols_news
     
@@ -163,30 +199,19 @@ class GetNews:
                               date:datetime,
                               save_in_file:bool = False, 
                               filename:str = 'output.json', 
-                              return_data: bool = True):
-    
-        delta = timedelta(nums / 5)
-
-        while True:
-
-            news = self.rest.get_news(
-                symbol,
-                start = (date - delta).date(),
-                end = date.date(),
-                limit = nums
-            )
+                              return_data: bool = True,
+                              per_symbol:bool = False):
 
-            if len(news) == nums:
-                break
-
-            delta *= 2
+        # The API only fills the gaps of the index, the latest articles are then a bisect away
+        self.index.update(self.rest, symbol, date, nums)
+        news = self.index.latest(symbol, date, nums, per_symbol)
 
         links = []
         symbols = []
 
         for new in news:
-            links.append(new.url)
-            symbols.append(new.symbols)
+            links.append(new['url'])
+            symbols.append(new['symbols'])
 
         news = self.get_news_by_link(links, symbols)
 
@@ -201,18 +226,39 @@ class GetNews:
             return news
 
 
+    def get_news_by_dates(self, queries:list, nums:int):
+
+        # queries: (symbol, date) pairs, each gets its latest nums articles and the union is crawled once
+        latest = []
+
+        for symbol, date in queries:
+            self.index.update(self.rest, symbol, date, nums)
+            latest.append(self.index.latest(symbol, date, nums))
+
+        links = dict()
+        for news in latest:
+            for new in news:
+                links.setdefault(new['url'], new['symbols'])
+
+        items = {item['url']: item for item in self.get_news_by_link(list(links.keys()), list(links.values()))}
+
+        # Newest first for every query, like get_symbols_by_num; articles the crawl could not read are left out
+        return [[items[new['url']] for new in news if new['url'] in items] for news in latest]
+
+
     def get_symbols_by_num(self, symbol:str | list[str], 
                                  nums:int,
                                  date:datetime,
                                  preprocess_titles:Callable | None = None,
-                                 preprocess_paragraphs:Callable | None = None):
+                                 preprocess_paragraphs:Callable | None = None,
+                                 per_symbol:bool = False):
         
         if type(preprocess_paragraphs) != type(preprocess_titles):
             raise ValueError('Ci devono essere o due o nessun preprocessor')
         
         symbol = [symbol] if isinstance(symbol, str) else symbol
 
-        news = self.get_news_by_num(symbol, nums, date)
+        news = self.get_news_by_num(symbol, nums, date, per_symbol=per_symbol)
 
         symbols_news = dict()
 
@@ -232,10 +278,12 @@ class GetNews:
 
                     symbols_news[symbol] = {
                         'title': [],
-                        'paragraphs': []
+                        'paragraphs': [],
+                        'url': []
                     }
                 
                 symbols_news[symbol]['title'].append(processed_title)
                 symbols_news[symbol]['paragraphs'].append(processed_paragraphs)
+                symbols_news[symbol]['url'].append(item.get('url'))
                    
         return symbols_news
\ No newline at end of file
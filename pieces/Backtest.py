@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+
+
+class Backtester:
+
+    def __init__(self, env, batch_size:int = 256):
+
+        # Any of the TradingEnv classes, only its timeline, observer and reward settings are used
+        self.env = env
+        self.timeline = env.timeline
+        self.observer = env.observer
+        self.batch_size = batch_size
+
+
+    def observations(self, cursors:np.ndarray):
+
+        prices = self.timeline.prices(cursors)
+        features = self.timeline.features(cursors) if self.observer.use_features else None
+
+        # The news of the whole batch in one crawl and one tokenizer call
+        return self.observer.observe_batch([self.env.symbol] * len(cursors),
+                                           [self.timeline.calendar[cursor] for cursor in cursors],
+                                           prices,
+                                           features)
+
+
+    def actions(self, policy, cursors:np.ndarray):
+
+        actions = np.empty(len(cursors), dtype=np.int64)
+
+        for start in range(0, len(cursors), self.batch_size):
+
+            batch = cursors[start:start + self.batch_size]
+            output = policy(self.observations(batch))
+
+            # A TradingNet returns (q_values, state), a plain callable may return q_values or actions
+            if isinstance(output, tuple):
+                output = output[0]
+
+            output = np.asarray(output)
+            actions[start:start + len(batch)] = output.argmax(-1) if output.ndim > 1 else output
+
+        return actions
+
+
+    def run(self, policy, start:datetime | None = None, end:datetime | None = None):
+
+        calendar = self.timeline.calendar
+
+        first = calendar.index(start) if start is not None else 0
+        last = min(calendar.index(end), len(calendar) - 1) if end is not None else len(calendar) - 1
+
+        if last <= first:
+            raise ValueError(f'Servono almeno due istanti tra {start} e {end}')
+
+        # Observations never depend on past actions, so every decision of the range is one batched pass
+        cursors = np.arange(first, last)
+        actions = self.actions(policy, cursors)
+
+        if not self.env.neutrality:
+            actions = np.minimum(actions, 1)
+
+        # Length of the neutral streak each step closes, the same counter the envs keep step by step
+        neutral = (actions == 2) if self.env.neutrality else np.zeros(len(actions), dtype=bool)
+        breaks = np.maximum.accumulate(np.where(neutral, -1, np.arange(len(actions))))
+        streak = np.concatenate([[0], np.arange(len(actions) - 1) - breaks[:-1]])
+
+        rewards = self.timeline.action_rewards(cursors, cursors + 1, streak)
+        premio = rewards[np.arange(len(actions)), actions]
+
+        equity, episode = self.equity(premio)
+
+        return pd.DataFrame({
+            'action': actions,
+            'reward': premio,
+            'equity': equity,
+            'episode': episode,
+            'close': self.timeline.closes[cursors + 1]
+        }, index=pd.DatetimeIndex(calendar.timestamps[cursors + 1].view('datetime64[ns]'), name='timestamp'))
+
+
+    def equity(self, premio:np.ndarray):
+
+        # Same as percent in the envs, an episode restarts from limit_percent when it goes below zero
+        # or, with limit_steps, once it has taken limit_steps + 1 steps
+        limit = float(self.env.limit_percent)
+        length = self.env.limit_steps + 1 if self.env.limit_steps else len(premio)
+
+        equity = np.empty(len(premio), dtype=np.float64)
+        episode = np.empty(len(premio), dtype=np.int64)
+
+        start = 0
+        count = 0
+
+        while start < len(premio):
+
+            curve = limit + np.cumsum(premio[start:start + length])
+            below = np.flatnonzero(curve < 0)
+            stop = start + (below[0] + 1 if len(below) else len(curve))
+
+            equity[start:stop] = curve[:stop - start]
+            episode[start:stop] = count
+
+            start = stop
+            count += 1
+
+        return equity, episode
+
+
+    @staticmethod
+    def summary(frame:pd.DataFrame):
+
+        premio = frame['reward'].to_numpy()
+        traded = frame['action'].to_numpy() != 2
+
+        peaks = frame.groupby('episode')['equity'].cummax()
+        std = premio.std()
+
+        return {
+            'steps': len(frame),
+            'episodes': int(frame['episode'].nunique()),
+            'total_reward': float(premio.sum()),
+            'mean_reward': float(premio.mean()),
+            'sharpe': float(premio.mean() / std) if std > 0 else 0.,
+            'hit_rate': float((premio[traded] > 0).mean()) if traded.any() else 0.,
+            'max_drawdown': float((peaks - frame['equity']).max()),
+            'actions': frame['action'].value_counts().sort_index().to_dict()
+        }
@@ -0,0 +1,329 @@
+import logging
+import yfinance as yf
+import numpy as np
+
+from prices import PricesClient, Backend, AlpacaBackend, FEATURES
+from prices.sessions import TradingCalendar
+from Timeline import EpisodeTimeline, EnvState
+from Observation import Observer
+from Cache import ObservationCache
+from Tokens import TokenStore
+
+from datetime import datetime, timedelta
+from typing import Callable
+from tf_agents.environments import py_environment
+from tf_agents.specs import ArraySpec, BoundedArraySpec
+from tf_agents.trajectories import time_step
+
+
+
+class BatchedTradingEnv(py_environment.PyEnvironment):
+
+    def __init__(self, api_key_alpaca:str,
+                       api_secret_alpaca:str,
+                       start:datetime,
+                       end:datetime,
+                       buying_simbols:list | str,
+                       batch_size:int | None = None,
+                       starts:list | None = None,
+                       interval_buying_time:timedelta = timedelta(hours=1),
+                       interval_prices:str = '1h',
+                       news_limit:int = 30,
+                       limit_percent:int = 100,
+                       limit_steps:int | None = 100,
+                       use_neutrality:bool = False,
+                       logger:logging.Logger | None = None,
+                       cache_dir:str | None = None,
+                       prices_backend:Backend | None = None,
+                       resample_prices:bool = False,
+                       use_features:bool = False,
+                       exchange:str = 'NASDAQ',
+                       random_start:bool = False,
+                       start_weights:Callable[[np.ndarray], np.ndarray] | None = None,
+                       seed:int | None = None,
+                       counterfactual_rewards:bool = False,
+                       observation_cache:ObservationCache | None = None,
+                       token_store:TokenStore | None = None):
+
+        # Episodes are reset one by one inside _step, the base class would reset all of them
+        super().__init__(handle_auto_reset=False)
+
+        supported = ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo']
+        if interval_prices not in supported:
+            raise ValueError(f'Interval dev\'essere in {supported}')
+
+        if isinstance(buying_simbols, str):
+            buying_simbols = [buying_simbols] * (batch_size or 1)
+
+        if batch_size is not None and batch_size != len(buying_simbols):
+            raise ValueError(f'Servono {batch_size} simboli, ne sono stati dati {len(buying_simbols)}')
+
+        for symbol in set(buying_simbols):
+            if (prices_backend is None or isinstance(prices_backend, AlpacaBackend)) and \
+                    yf.Ticker(symbol).info.get('exchange', 0) != 'NMS':
+                raise NotImplementedError(f'Simboli come {symbol} non sono implementati')
+
+        self.start = start
+        self.stop = end
+
+        self.interval_buying_time = interval_buying_time
+        self.interval_prices = interval_prices
+        self.symbols = list(buying_simbols)
+        self.news_limit = news_limit
+
+        self.limit_percent = limit_percent
+        self.limit_steps = limit_steps
+        self.neutrality = use_neutrality
+
+        # Opt-in, the reward of every action for the step just taken is kept in info['rewards']
+        self.counterfactual_rewards = counterfactual_rewards
+        self.info = dict()
+
+        self.calendar = TradingCalendar(start, end, interval_buying_time, exchange)
+
+        self.client = PricesClient(api_key_alpaca,
+                                   api_secret_alpaca,
+                                   cache_dir = cache_dir,
+                                   backend = prices_backend,
+                                   resample = resample_prices)
+
+        self.observer = Observer(
+            api_key_alpaca,
+            api_secret_alpaca,
+            news_limit,
+            interval_prices,
+            client = self.client,
+            use_features = use_features,
+            cache = observation_cache,
+            tokens = token_store,
+            cache_dir = cache_dir
+        )
+
+        if isinstance(logger, logging.Logger):
+
+            self.logger = logger.getChild('env')
+            self.logger.setLevel(logger.level)
+
+            for handler in logger.handlers:
+                self.logger.addHandler(handler)
+
+        else:
+            self.logger = logging.getLogger('env')
+
+        # One timeline per distinct symbol, episodes on the same symbol share it
+        self.timelines = {symbol: EpisodeTimeline(self.client, symbol, self.calendar, interval_prices)
+                                for symbol in dict.fromkeys(self.symbols)}
+
+        self.groups = [(self.timelines[symbol], np.flatnonzero(np.array(self.symbols) == symbol))
+                                for symbol in self.timelines]
+
+        n = len(self.symbols)
+
+        # Without explicit offsets the episodes start evenly spread over the range
+        if starts is None:
+            starts = np.arange(n) * len(self.calendar) // n
+
+        if len(starts) != n:
+            raise ValueError(f'Servono {n} indici di partenza, ne sono stati dati {len(starts)}')
+
+        self.cursor = np.asarray(starts, dtype=np.int64) % len(self.calendar)
+        self.percent = np.full(n, limit_percent, dtype=np.float64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.neutrality_counter = np.zeros(n, dtype=np.int64)
+
+        self._done = np.zeros(n, dtype=bool)
+
+        # Every symbol shares the calendar, so one distribution of starts serves all the episodes
+        self.rng = np.random.default_rng(seed)
+        self.start_cdf = self.groups[0][0].start_cdf(limit_steps, start_weights) if random_start else None
+
+
+    @property
+    def batched(self):
+
+        return True
+
+
+    @property
+    def batch_size(self):
+
+        return len(self.symbols)
+
+
+    def observation_spec(self):
+
+        spec = {
+
+            'simbolo': BoundedArraySpec(shape=(1, 5),
+                                        dtype=np.int32,
+                                        minimum=0,
+                                        maximum=self.observer.tokenizer.vocab_size - 1),
+
+            'titolo': BoundedArraySpec(shape=(self.news_limit, 100),
+                                        dtype=np.int32,
+                                        minimum=0,
+                                        maximum=self.observer.tokenizer.vocab_size - 1),
+
+            'paragrafi': BoundedArraySpec(shape=(self.news_limit, 512),
+                                            dtype=np.int32,
+                                            minimum=0,
+                                            maximum=self.observer.tokenizer.vocab_size - 1),
+
+            'prezzi': ArraySpec(shape=(50, 7), dtype=np.float32)
+        }
+
+        if self.observer.use_features:
+            spec['indicatori'] = ArraySpec(shape=(50, len(FEATURES)), dtype=np.float32)
+
+        return spec
+
+
+    def action_spec(self):
+
+        return BoundedArraySpec(
+            shape = (),
+            dtype = np.int32,
+            minimum = 0,
+            maximum = 2 if self.neutrality else 1
+        )
+
+
+    def get_tokenizer(self):
+        return self.observer.tokenizer
+
+
+    def get_info(self):
+        return self.info
+
+
+    def get_state(self):
+
+        # Copies, the arrays are updated in place by the next steps
+        return EnvState(self.cursor.copy(),
+                        self.percent.copy(),
+                        self.steps.copy(),
+                        self.neutrality_counter.copy(),
+                        self.rng.bit_generator.state,
+                        self._done.copy())
+
+
+    def set_state(self, state:EnvState):
+
+        self.cursor[:] = state.cursor
+        self.percent[:] = state.percent
+        self.steps[:] = state.steps
+        self.neutrality_counter[:] = state.neutrality_counter
+        self.rng.bit_generator.state = state.rng
+        self._done[:] = state.extra
+
+
+    def get_observation(self):
+
+        prices = np.empty((self.batch_size, 50, 7), dtype=np.float32)
+        features = np.empty((self.batch_size, 50, len(FEATURES)), dtype=np.float32) \
+                        if self.observer.use_features else None
+
+        # Price windows are gathered with one fancy index per symbol, the news of every episode in one batch
+        for timeline, idx in self.groups:
+            prices[idx] = timeline.prices(self.cursor[idx])
+
+            if features is not None:
+                features[idx] = timeline.features(self.cursor[idx])
+
+        return self.observer.observe_batch(list(self.symbols),
+                                           [self.calendar[cursor] for cursor in self.cursor],
+                                           prices,
+                                           features)
+
+
+    def _time_step(self, step_type:np.ndarray, reward:np.ndarray):
+
+        return time_step.TimeStep(
+            step_type = step_type.astype(np.int32),
+            reward = reward.astype(np.float32),
+            discount = (step_type != time_step.StepType.LAST).astype(np.float32),
+            observation = self.get_observation()
+        )
+
+
+    def _reset(self):
+
+        self.steps[:] = 0
+        self.percent[:] = self.limit_percent
+        self._done[:] = False
+
+        if self.start_cdf is not None:
+            self.cursor[:] = self.groups[0][0].sample_start(self.start_cdf, self.rng, self.batch_size)
+            self.neutrality_counter[:] = 0
+
+        return self._time_step(np.full(self.batch_size, time_step.StepType.FIRST), np.zeros(self.batch_size))
+
+
+    def action_rewards(self, previous:np.ndarray):
+
+        rewards = np.empty((self.batch_size, 3), dtype=np.float64)
+
+        for timeline, idx in self.groups:
+            rewards[idx] = timeline.action_rewards(previous[idx], self.cursor[idx], self.neutrality_counter[idx])
+
+        return rewards
+
+
+    def _step(self, action):
+
+        action = np.asarray(action, dtype=np.int64).reshape(self.batch_size)
+
+        # Episodes that ended on the previous step restart instead of acting
+        restart = self._done.copy()
+        self.steps[restart] = 0
+        self.percent[restart] = self.limit_percent
+
+        if self.start_cdf is not None and restart.any():
+            self.cursor[restart] = self.groups[0][0].sample_start(self.start_cdf, self.rng, int(restart.sum()))
+            self.neutrality_counter[restart] = 0
+
+        previous = self.cursor.copy()
+
+        advance = ~restart
+        self.cursor[advance] = (self.cursor[advance] + 1) % len(self.calendar)
+
+        # One (batch, actions) table per step, restarting episodes get a zero reward whatever they chose
+        rewards = np.where(restart[:, None], 0., self.action_rewards(previous))
+        premio = rewards[np.arange(self.batch_size), action]
+
+        if self.neutrality:
+            counter = np.where(action == 2, self.neutrality_counter + 1, 0)
+            self.neutrality_counter = np.where(advance, counter, self.neutrality_counter)
+
+        self.info = {'rewards': rewards[:, :3 if self.neutrality else 2].astype(np.float32)} \
+                        if self.counterfactual_rewards else dict()
+        self.percent += premio
+
+        self.logger.info(f'Updating observation and reward: {{{premio}}}')
+
+        # Same order of checks as TradingEnv, the first one that applies decides where the cursor goes
+        end_of_range = self.cursor + 1 >= len(self.calendar)
+        by_percent = self.percent < 0
+        by_steps = np.zeros(self.batch_size, dtype=bool)
+
+        if self.limit_steps:
+            self.steps[advance] += 1
+            by_steps = self.limit_steps < self.steps
+
+            rewind = by_steps & (self.cursor + self.limit_steps >= len(self.calendar))
+
+        else:
+            rewind = np.zeros(self.batch_size, dtype=bool)
+
+        self.percent[~by_steps & by_percent] = self.limit_percent
+        rewind |= ~by_steps & ~by_percent & end_of_range
+
+        done = advance & (by_steps | by_percent | end_of_range)
+        self.cursor[done & rewind] = 0
+
+        self._done = done
+
+        step_type = np.where(restart, time_step.StepType.FIRST,
+                        np.where(done, time_step.StepType.LAST, time_step.StepType.MID))
+
+        return self._time_step(step_type, premio)
@@ -0,0 +1,114 @@
+import os
+import uuid
+import hashlib
+import numpy as np
+
+from collections import OrderedDict
+
+
+class ObservationCache:
+
+    def __init__(self, max_bytes:int = 512 * 2 ** 20,
+                       directory:str | None = None):
+
+        self.max_bytes = max_bytes
+        self.directory = directory
+
+        self._entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+
+    def __len__(self):
+
+        return len(self._entries)
+
+
+    def _path(self, key:tuple):
+
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+
+        return os.path.join(self.directory, name[:2], f'{name}.npz')
+
+
+    def _remember(self, key:tuple, value:dict):
+
+        size = sum(array.nbytes for array in value.values())
+
+        # Larger than the whole budget, kept on disk only
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+
+        self._entries[key] = (value, size)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+
+    def get(self, key:tuple):
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return self._entries[key][0]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+
+            with np.load(self._path(key)) as file:
+                value = {name: file[name] for name in file.files}
+
+            self._remember(key, value)
+            self.disk_hits += 1
+
+            return value
+
+        self.misses += 1
+
+        return None
+
+
+    def put(self, key:tuple, value:dict):
+
+        # Arrays are shared with the caller, they must not be changed in place afterwards
+        for array in value.values():
+            array.flags.writeable = False
+
+        self._remember(key, value)
+
+        if self.directory is None:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written aside and renamed, a reader never sees half a file
+        tmp = os.path.join(os.path.dirname(path), f'.{uuid.uuid4().hex}.tmp.npz')
+        np.savez(tmp, **value)
+        os.replace(tmp, path)
+
+
+    def stats(self):
+
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
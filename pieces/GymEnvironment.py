@@ -5,11 +5,16 @@ import pandas_market_calendars as mcal
 import numpy as np
 import tensorflow as tf
 
-from prices import PricesClient
+from prices import PricesClient, Backend, AlpacaBackend, FEATURES
+from prices.sessions import TradingCalendar
+from Timeline import EpisodeTimeline, EnvState
 from news import GetNews
 from Observation import Observer
+from Cache import ObservationCache
+from Tokens import TokenStore
 
 from datetime import datetime, timedelta
+from typing import Callable
 from transformers import AutoTokenizer
 from gym.spaces import Box, Dict
 
@@ -28,7 +33,18 @@ class TradingEnv(gym.Env):
                        limit_percent:int = 100,
                        limit_steps:int | None = 100,
                        use_neutrality:bool = False,
-                       logger:logging.Logger | None = None):
+                       logger:logging.Logger | None = None,
+                       cache_dir:str | None = None,
+                       prices_backend:Backend | None = None,
+                       resample_prices:bool = False,
+                       use_features:bool = False,
+                       exchange:str = 'NASDAQ',
+                       random_start:bool = False,
+                       start_weights:Callable[[np.ndarray], np.ndarray] | None = None,
+                       seed:int | None = None,
+                       counterfactual_rewards:bool = False,
+                       observation_cache:ObservationCache | None = None,
+                       token_store:TokenStore | None = None):
         
 
         super().__init__()
@@ -37,7 +53,9 @@ class TradingEnv(gym.Env):
         if interval_prices not in supported:
             raise ValueError(f'Interval dev\'essere in {supported}')
         
-        if yf.Ticker(buying_simbol).info.get('exchange', 0) != 'NMS':
+        # Offline backends replay or generate any symbol, only real Alpaca data is limited to the Nasdaq
+        if (prices_backend is None or isinstance(prices_backend, AlpacaBackend)) and \
+                yf.Ticker(buying_simbol).info.get('exchange', 0) != 'NMS':
             raise NotImplementedError(f'Simboli come {buying_simbol} non sono implementati')
 
         self.start = start
@@ -56,16 +74,30 @@ class TradingEnv(gym.Env):
         self.neutrality_counter = 0
         self.neutrality = use_neutrality
 
-        self.nasdaq_close = datetime(self.date.year, self.date.month, self.date.day + 1)
-        self.nasdaq_open = datetime(self.date.year, self.date.month, self.date.day, 9)
+        # Opt-in, the reward of every action for the step just taken is kept in info['rewards']
+        self.counterfactual_rewards = counterfactual_rewards
+        self.info = dict()
 
-        self.client = PricesClient(api_key_alpaca, api_secret_alpaca)
+        # Every decision time of the range, advancing the clock is just moving the cursor
+        self.calendar = TradingCalendar(start, end, interval_buying_time, exchange)
+        self.cursor = 0
+
+        self.client = PricesClient(api_key_alpaca, 
+                                   api_secret_alpaca, 
+                                   cache_dir = cache_dir, 
+                                   backend = prices_backend,
+                                   resample = resample_prices)
 
         self.observer = Observer(
             api_key_alpaca,
             api_secret_alpaca,
             news_limit,
-            interval_prices
+            interval_prices,
+            client = self.client,
+            use_features = use_features,
+            cache = observation_cache,
+            tokens = token_store,
+            cache_dir = cache_dir
         )
 
         self.observation_space = self.observation_spec()
@@ -89,7 +121,14 @@ class TradingEnv(gym.Env):
                 style = r'{'
             )
         
-        self.update_date()
+        # Decision times, prices and observation windows of the whole range, built once
+        self.timeline = EpisodeTimeline(self.client, self.symbol, self.calendar, interval_prices)
+
+        # With random starts every reset jumps to a sampled cursor, weighted by start_weights(timestamps) if given
+        self.rng = np.random.default_rng(seed)
+        self.start_cdf = self.timeline.start_cdf(limit_steps, start_weights) if random_start else None
+
+        self.seek(0)
 
 
     def setup_logger(self, *, 
@@ -134,51 +173,40 @@ class TradingEnv(gym.Env):
         return logger
     
 
-    def update_date(self):
+    def seek(self, cursor:int):
 
-        self.logger.info('Updating date')
-        self.date += self.interval_buying_time
+        self.cursor = cursor
+        self.date = self.calendar[cursor]
 
-        self.date = self.start if self.date > self.stop or self.date < self.start else self.date
 
-        if self.date < self.nasdaq_open:
+    def get_state(self):
 
-            self.date = datetime(
-                self.date.year,
-                self.date.month,
-                self.date.day,
-                9
-            )
+        # Prices and observations live in the timeline, the position in it is all that changes
+        return EnvState(self.cursor,
+                        self.percent,
+                        self.steps,
+                        self.neutrality_counter,
+                        self.rng.bit_generator.state)
 
-        if self.date > self.nasdaq_close:
 
-            self.date = datetime(
-                self.date.year,
-                self.date.month,
-                self.date.day,
-                9
-            )
+    def set_state(self, state:EnvState):
 
-            self.nasdaq_close = datetime(self.date.year, self.date.month, self.date.day + 1)
-            self.nasdaq_open = datetime(self.date.year, self.date.month, self.date.day, 9)
-        
-        while True:
+        self.seek(state.cursor)
+        self.percent = state.percent
+        self.steps = state.steps
+        self.neutrality_counter = state.neutrality_counter
+        self.rng.bit_generator.state = state.rng
 
-            dates = self.client.get_data_prices(
-                'AAPL',
-                self.date - self.interval_buying_time,
-                self.date + self.interval_buying_time
-            )
 
-            if not dates.empty:
-                break
+    def update_date(self):
 
-            self.date += timedelta(1)
+        self.logger.info('Updating date')
+        self.seek((self.cursor + 1) % len(self.calendar))
 
     
     def observation_spec(self):
         
-        return Dict({
+        spec = {
 
             'simbolo': Box(shape=(1, 5), 
                            dtype=np.int32,
@@ -199,7 +227,15 @@ class TradingEnv(gym.Env):
                           dtype=np.float32,
                           low=-np.inf,
                           high=np.inf)
-        })
+        }
+
+        if self.observer.use_features:
+            spec['indicatori'] = Box(shape=(50, len(FEATURES)), 
+                                     dtype=np.float32,
+                                     low=-np.inf,
+                                     high=np.inf)
+
+        return Dict(spec)
     
 
     def action_spec(self):
@@ -218,73 +254,42 @@ class TradingEnv(gym.Env):
 
     def get_observation(self):
         
-        return self.observer(self.symbol, self.date)
+        return self.observer(self.symbol, 
+                             self.date, 
+                             self.timeline.prices(self.cursor),
+                             self.timeline.features(self.cursor) if self.observer.use_features else None)
     
 
     def reset(self):
         self.steps = 0
         self.percent = self.limit_percent
+
+        if self.start_cdf is not None:
+            self.seek(self.timeline.sample_start(self.start_cdf, self.rng))
+            self.neutrality_counter = 0
         
         return self.get_observation()
     
 
     def step(self, action):
 
-        last_price = self.client.get_last_price(self.symbol, self.date)['close']
+        previous = self.cursor
         self.update_date()
 
-        current_price = self.client.get_last_price(self.symbol, self.date)['close']
-
-        if action == 0:
-
-            premio = ((last_price - current_price) / last_price) * 100
-            self.neutrality_counter = 0
-
-            if self.neutrality_counter != 0 and self.neutrality:
-
-                time_whithout = timedelta(1) * self.neutrality_counter
-
-                prices = self.client.get_delta_prices(self.symbol, 
-                                                      self.date, 
-                                                      time_whithout, 
-                                                      self.interval_prices)['close']
-                val_min = min(prices.values[len(prices)-self.neutrality_counter-1:-1])
-
-
-                if val_min <= current_price:
-                    premio *= 1.2 if premio < 0 else 0.8
-
-                else:
-                    premio *= 1.2 if premio > 0 else 0.8
-
-
-        elif action == 1:
-
-            premio = ((current_price - last_price) / last_price) * 100
-            self.neutrality_counter = 0
+        # Every action's reward comes out of the same pass, the chosen one is an index into it
+        rewards = self.timeline.action_rewards(previous, self.cursor, self.neutrality_counter)
+        premio = float(rewards[action])
 
-            if self.neutrality_counter != 0 and self.neutrality:
+        if action == 2:
 
-                time_whithout = timedelta(1) * self.neutrality_counter
-
-                prices = self.client.get_delta_prices(self.symbol, 
-                                                      self.date, 
-                                                      time_whithout, 
-                                                      self.interval_prices)['close']
-                val_max = max(prices.values[len(prices)-self.neutrality_counter-1:-1])
-
-                if val_max <= current_price:
-                    premio *= 1.2 if premio < 0 else 0.8
-
-                else:
-                    premio *= 1.2 if premio > 0 else 0.8
+            if self.neutrality:
+                self.neutrality_counter += 1
 
         else:
+            self.neutrality_counter = 0
 
-            if self.neutrality:
-                self.neutrality_counter += 1
-            
-            premio = 0
+        self.info = {'rewards': rewards[:3 if self.neutrality else 2].astype(np.float32)} \
+                        if self.counterfactual_rewards else dict()
 
         self.percent += premio
 
@@ -295,20 +300,20 @@ class TradingEnv(gym.Env):
 
             if self.limit_steps < self.steps:
 
-                if self.date + self.interval_buying_time * self.limit_steps > self.stop:
-                    self.date = self.start
+                if self.cursor + self.limit_steps >= len(self.calendar):
+                    self.seek(0)
 
-                return self.get_observation(), np.array(premio, dtype=np.float32), np.array(1), {}
+                return self.get_observation(), np.array(premio, dtype=np.float32), np.array(1), self.info
             
         if self.percent < 0:
             self.percent = self.limit_percent
 
-            return self.get_observation(), np.array(premio, dtype=np.float32), np.array(1), {}
+            return self.get_observation(), np.array(premio, dtype=np.float32), np.array(1), self.info
         
-        if (self.date + self.interval_buying_time) > self.stop:
-            self.date = self.start
+        if self.cursor + 1 >= len(self.calendar):
+            self.seek(0)
 
-            return self.get_observation(), np.array(premio, dtype=np.float32), np.array(1), {}
+            return self.get_observation(), np.array(premio, dtype=np.float32), np.array(1), self.info
 
 
-        return self.get_observation(), np.array(premio, dtype=np.float32), np.array(0), {}
\ No newline at end of file
+        return self.get_observation(), np.array(premio, dtype=np.float32), np.array(0), self.info
\ No newline at end of file
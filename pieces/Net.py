@@ -196,7 +196,13 @@ class TradingNet(Network):
                                 step['paragrafi']), 
                                training = training)
         
-        prices_part = self._prices(step['prezzi'], 
+        prices = step['prezzi']
+
+        # Precomputed indicators, when the env provides them, extend every bar of the window
+        if 'indicatori' in step:
+            prices = tf.concat([prices, step['indicatori']], axis=-1)
+
+        prices_part = self._prices(prices, 
                                    training = training)
 
         x = tf.concat([news_part, prices_part], axis=1)
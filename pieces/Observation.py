@@ -1,80 +1,239 @@
-import tensorflow as tf
 import numpy as np
 
 from transformers import AutoTokenizer
-from prices import PricesClient
+from prices import PricesClient, to_ns
 from news import GetNews
+from Cache import ObservationCache
+from Tokens import TokenStore
 
 from datetime import datetime
 
 
+def fit_left(ids:np.ndarray, width:int):
+
+    # Like pad_sequences: zeros on the left, and only the last width tokens when longer
+    out = np.zeros((len(ids), width), np.int32)
+    count = min(ids.shape[1], width)
+
+    if count:
+        out[:, width - count:] = ids[:, ids.shape[1] - count:]
+
+    return out
+
+
+def tokenize_news(tokenizer, titles:list, paragraphs:list, title_length:int = 100, paragraph_length:int = 512):
+
+    # Titles and the first paragraph of every article go through a single fast-tokenizer call
+    texts = [title or '' for title in titles] + \
+                [article[0] if article else tokenizer.pad_token for article in paragraphs]
+
+    if not texts:
+        return np.zeros((0, title_length), np.int32), np.zeros((0, paragraph_length), np.int32)
+
+    ids = tokenizer(texts,
+                    truncation = True,
+                    max_length = paragraph_length,
+                    padding = 'longest',
+                    return_attention_mask = False,
+                    return_token_type_ids = False,
+                    return_tensors = 'np')['input_ids']
+
+    return fit_left(ids[:len(titles)], title_length), fit_left(ids[len(titles):], paragraph_length)
+
+
 class Observer:
 
+    VERSION = 2
+
     def __init__(self, api_key_alpaca:str,
                        api_secret_alpaca:str,
                        news_limit:int = 30,
-                       interval_prices:str = '1h'):
+                       interval_prices:str = '1h',
+                       client:PricesClient | None = None,
+                       use_features:bool = False,
+                       cache:ObservationCache | None = None,
+                       tokens:TokenStore | None = None,
+                       cache_dir:str | None = None):
         
         supported = ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo']
         if interval_prices not in supported:
             raise ValueError(f'Interval dev\'essere in {supported}')
 
-        self.tokenizer = AutoTokenizer.from_pretrained('bert-base-uncased')
-        self.client = PricesClient(api_key_alpaca, api_secret_alpaca)
-        self.rest = GetNews(api_key_alpaca, api_secret_alpaca)
+        self.tokenizer = AutoTokenizer.from_pretrained('bert-base-uncased', use_fast=True)
+
+        # Padding on the left, the side pad_sequences always used
+        self.tokenizer.padding_side = 'left'
+        self._symbols = dict()
+        self.client = client if client is not None else PricesClient(api_key_alpaca, api_secret_alpaca)
+        self.rest = GetNews(api_key_alpaca, api_secret_alpaca, cache_dir)
 
         self.news_limit = news_limit
         self.interval_prices = interval_prices
+        self.use_features = use_features
+        self.cache = cache
+        self.tokens = tokens
 
 
-    def __call__(self, symbol:str, date:datetime):
+    def tokenize(self, titles:list, paragraphs:list, urls:list | None = None):
 
-        def titles(x):
+        if self.tokens is None or urls is None:
+            return tokenize_news(self.tokenizer, titles, paragraphs)
 
-            return tf.keras.preprocessing.sequence.pad_sequences(
-                            self.tokenizer(x, return_tensors='tf')['input_ids'],
-                            maxlen=100)[0]
-        
-        def paragraphs(x):
+        out_titles, out_paragraphs, found = self.tokens.rows(urls)
+        missing = np.flatnonzero(~found)
 
-            if x == []:
+        # Only the articles the offline pipeline has not seen yet go through the tokenizer
+        if len(missing):
+            out_titles[missing], out_paragraphs[missing] = tokenize_news(self.tokenizer,
+                                                                         [titles[i] for i in missing],
+                                                                         [paragraphs[i] for i in missing])
 
-                return tf.keras.preprocessing.sequence.pad_sequences(
-                            self.tokenizer([self.tokenizer.pad_token],
-                                return_tensors='tf')['input_ids'],
-                            maxlen=512)[0] 
-            
-            else:
+        return out_titles, out_paragraphs
+
+
+    def _symbol(self, symbol:str):
+
+        # The symbol never changes, it is tokenized once
+        if symbol not in self._symbols:
+            self._symbols[symbol] = fit_left(self.tokenizer([symbol], return_tensors='np')['input_ids'], 5)
+
+        return self._symbols[symbol]
+
+
+    def _key(self, symbol:str, date:datetime):
+
+        # Everything the news part depends on, prices come from the timeline and are never cached
+        return (symbol, to_ns(date), self.interval_prices, self.news_limit, self.tokenizer.name_or_path, self.VERSION)
+
+
+    def _news(self, symbol:str, titles:np.ndarray, paragraphs:np.ndarray):
+
+        # Always news_limit rows, a step with fewer articles leaves the last ones empty
+        count = min(len(titles), self.news_limit)
+
+        part = {
+            'simbolo': self._symbol(symbol),
+            'titolo': np.zeros((self.news_limit, titles.shape[1]), np.int32),
+            'paragrafi': np.zeros((self.news_limit, paragraphs.shape[1]), np.int32)
+        }
+
+        part['titolo'][:count] = titles[:count]
+        part['paragrafi'][:count] = paragraphs[:count]
+
+        return part
+
+
+    def _cached(self, key:tuple, fetch):
+
+        if self.cache is None:
+            return fetch()
+
+        value = self.cache.get(key)
 
-                return tf.keras.preprocessing.sequence.pad_sequences(
-                            self.tokenizer(x, 
-                                padding=True, 
-                                truncation=True,
-                                return_tensors='tf')['input_ids'],
-                            maxlen=512)[0] 
-                                        
+        if value is None:
+            value = fetch()
+            self.cache.put(key, value)
 
-        news = self.rest.get_symbols_by_num(symbol,
-                                            self.news_limit,
-                                            date,
-                                            titles, 
-                                            paragraphs
-                                        )[symbol]
+        return value
 
-        return {
 
-            'simbolo': np.array(tf.keras.preprocessing.sequence.pad_sequences(
-                            self.tokenizer(symbol, return_tensors='tf')['input_ids'],
-                            maxlen=5), dtype=np.int32),
+    def __call__(self, symbol:str, 
+                       date:datetime, 
+                       prices:np.ndarray | None = None, 
+                       features:np.ndarray | None = None):
 
-            'titolo': np.array(news['title'], np.int32),
+        def fetch():
 
-            'paragrafi': np.array(news['paragraphs'], np.int32),
+            news = self.rest.get_symbols_by_num(symbol,
+                                                self.news_limit,
+                                                date
+                                            ).get(symbol, {'title': [], 'paragraphs': [], 'url': []})
+
+            titles, paragraphs = self.tokenize(news['title'][:self.news_limit],
+                                               news['paragraphs'][:self.news_limit],
+                                               news['url'][:self.news_limit])
+
+            return self._news(symbol, titles, paragraphs)
+
+        observation = {
+
+            **self._cached(self._key(symbol, date), fetch),
             
-            'prezzi': np.array(self.client.get_num_prices(
+            # A view on the memory mapped bar store, float32 already so nothing is converted
+            'prezzi': np.asarray(prices if prices is not None else self.client.get_num_bars(
+                                                symbol,
+                                                date,
+                                                50,
+                                                self.interval_prices)[1], 
+                                        np.float32)
+        }
+
+        if self.use_features:
+            observation['indicatori'] = np.asarray(features if features is not None else self.client.get_num_features(
                                                 symbol,
                                                 date,
                                                 50,
-                                                self.interval_prices), 
+                                                self.interval_prices),
                                         np.float32)
-        }
\ No newline at end of file
+
+        return observation
+
+
+    def observe_many(self, symbols:list, 
+                           date:datetime, 
+                           prices:np.ndarray, 
+                           features:np.ndarray | None = None):
+
+        return self.observe_batch(symbols, [date] * len(symbols), prices, features)
+
+
+    def observe_batch(self, symbols:list, 
+                            dates:list, 
+                            prices:np.ndarray, 
+                            features:np.ndarray | None = None):
+
+        keys = [self._key(symbol, date) for symbol, date in zip(symbols, dates)]
+        parts = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        missing = [i for i, part in enumerate(parts) if part is None]
+
+        # One crawl for every (symbol, date) not cached, each with its own latest news_limit articles as in __call__
+        if missing:
+
+            news = self.rest.get_news_by_dates([(symbols[i], dates[i]) for i in missing], self.news_limit)
+
+            # Consecutive steps share most of their articles, every one of them is tokenized once
+            articles = dict()
+            for items in news:
+                for item in items[:self.news_limit]:
+                    articles.setdefault(item['url'], item)
+
+            urls = list(articles.keys())
+            rows = {url: row for row, url in enumerate(urls)}
+
+            all_titles, all_paragraphs = self.tokenize([articles[url]['title'] for url in urls],
+                                                       [articles[url]['paragraphs'] for url in urls],
+                                                       urls)
+
+            for i, items in zip(missing, news):
+
+                idx = [rows[item['url']] for item in items[:self.news_limit]]
+                parts[i] = self._news(symbols[i], all_titles[idx], all_paragraphs[idx])
+
+                if self.cache is not None:
+                    self.cache.put(keys[i], parts[i])
+
+        observation = {
+
+            'simbolo': np.stack([part['simbolo'] for part in parts]),
+
+            'titolo': np.stack([part['titolo'] for part in parts]),
+
+            'paragrafi': np.stack([part['paragrafi'] for part in parts]),
+
+            'prezzi': np.asarray(prices, np.float32)
+        }
+
+        if self.use_features:
+            observation['indicatori'] = np.asarray(features, np.float32)
+
+        return observation
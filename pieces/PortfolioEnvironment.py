@@ -0,0 +1,263 @@
+import logging
+import yfinance as yf
+import numpy as np
+
+from prices import PricesClient, Backend, AlpacaBackend, FEATURES
+from prices.sessions import TradingCalendar
+from Timeline import EpisodeTimeline
+from Observation import Observer
+from Cache import ObservationCache
+from Tokens import TokenStore
+
+from datetime import datetime, timedelta
+from tf_agents.environments import py_environment
+from tf_agents.specs import ArraySpec, BoundedArraySpec
+from tf_agents.trajectories import time_step
+
+
+
+class PortfolioTradingEnv(py_environment.PyEnvironment):
+
+    def __init__(self, api_key_alpaca:str,
+                       api_secret_alpaca:str,
+                       start:datetime,
+                       end:datetime,
+                       buying_simbols:list,
+                       interval_buying_time:timedelta = timedelta(hours=1),
+                       interval_prices:str = '1h',
+                       news_limit:int = 30,
+                       limit_percent:int = 100,
+                       limit_steps:int | None = 100,
+                       use_neutrality:bool = False,
+                       logger:logging.Logger | None = None,
+                       cache_dir:str | None = None,
+                       prices_backend:Backend | None = None,
+                       resample_prices:bool = False,
+                       use_features:bool = False,
+                       exchange:str = 'NASDAQ',
+                       observation_cache:ObservationCache | None = None,
+                       token_store:TokenStore | None = None):
+
+        super().__init__(handle_auto_reset=True)
+
+        supported = ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo']
+        if interval_prices not in supported:
+            raise ValueError(f'Interval dev\'essere in {supported}')
+
+        if len(set(buying_simbols)) != len(buying_simbols):
+            raise ValueError('I simboli del portafoglio devono essere distinti')
+
+        for symbol in buying_simbols:
+            if (prices_backend is None or isinstance(prices_backend, AlpacaBackend)) and \
+                    yf.Ticker(symbol).info.get('exchange', 0) != 'NMS':
+                raise NotImplementedError(f'Simboli come {symbol} non sono implementati')
+
+        self.start = start
+        self.date = start
+        self.stop = end
+
+        self.interval_buying_time = interval_buying_time
+        self.interval_prices = interval_prices
+        self.symbols = list(buying_simbols)
+        self.news_limit = news_limit
+
+        self.limit_percent = limit_percent
+        self.percent = limit_percent
+        self.peak = limit_percent
+        self.limit_steps = limit_steps
+        self.steps = 0
+
+        self.neutrality = use_neutrality
+        self.neutrality_counter = np.zeros(len(self.symbols), dtype=np.int64)
+
+        self.calendar = TradingCalendar(start, end, interval_buying_time, exchange)
+        self.cursor = 0
+
+        # A single client, so every asset reads from the same bar store
+        self.client = PricesClient(api_key_alpaca,
+                                   api_secret_alpaca,
+                                   cache_dir = cache_dir,
+                                   backend = prices_backend,
+                                   resample = resample_prices)
+
+        self.observer = Observer(
+            api_key_alpaca,
+            api_secret_alpaca,
+            news_limit,
+            interval_prices,
+            client = self.client,
+            use_features = use_features,
+            cache = observation_cache,
+            tokens = token_store,
+            cache_dir = cache_dir
+        )
+
+        if isinstance(logger, logging.Logger):
+
+            self.logger = logger.getChild('env')
+            self.logger.setLevel(logger.level)
+
+            for handler in logger.handlers:
+                self.logger.addHandler(handler)
+
+        else:
+            self.logger = logging.getLogger('env')
+
+        # Every asset's range in shared multi-symbol requests, the timelines then read it from the store
+        self.client.preload(self.symbols, self.calendar[0], self.calendar[-1], interval_prices)
+
+        self.timelines = [EpisodeTimeline(self.client, symbol, self.calendar, interval_prices)
+                                for symbol in self.symbols]
+
+        # (steps, assets), one row per decision time
+        self.closes = np.stack([timeline.closes for timeline in self.timelines], axis=1)
+
+        self.info = dict()
+
+        self.seek(0)
+
+
+    def seek(self, cursor:int):
+
+        self.cursor = cursor
+        self.date = self.calendar[cursor]
+
+
+    def update_date(self):
+
+        self.logger.info('Updating date')
+        self.seek((self.cursor + 1) % len(self.calendar))
+
+
+    def observation_spec(self):
+
+        assets = len(self.symbols)
+
+        spec = {
+
+            'simbolo': BoundedArraySpec(shape=(assets, 1, 5),
+                                        dtype=np.int32,
+                                        minimum=0,
+                                        maximum=self.observer.tokenizer.vocab_size - 1),
+
+            'titolo': BoundedArraySpec(shape=(assets, self.news_limit, 100),
+                                        dtype=np.int32,
+                                        minimum=0,
+                                        maximum=self.observer.tokenizer.vocab_size - 1),
+
+            'paragrafi': BoundedArraySpec(shape=(assets, self.news_limit, 512),
+                                            dtype=np.int32,
+                                            minimum=0,
+                                            maximum=self.observer.tokenizer.vocab_size - 1),
+
+            'prezzi': ArraySpec(shape=(assets, 50, 7), dtype=np.float32)
+        }
+
+        if self.observer.use_features:
+            spec['indicatori'] = ArraySpec(shape=(assets, 50, len(FEATURES)), dtype=np.float32)
+
+        return spec
+
+
+    def action_spec(self):
+
+        # One action per asset: 0 short, 1 long, 2 out of the market when neutrality is enabled
+        return BoundedArraySpec(
+            shape = (len(self.symbols),),
+            dtype = np.int32,
+            minimum = 0,
+            maximum = 2 if self.neutrality else 1
+        )
+
+
+    def get_tokenizer(self):
+        return self.observer.tokenizer
+
+
+    def get_info(self):
+        return self.info
+
+
+    def get_observation(self):
+
+        prices = np.stack([timeline.prices(self.cursor) for timeline in self.timelines])
+        features = np.stack([timeline.features(self.cursor) for timeline in self.timelines]) \
+                        if self.observer.use_features else None
+
+        return self.observer.observe_many(self.symbols, self.date, prices, features)
+
+
+    def action_rewards(self, previous:int, cursor:int):
+
+        last_price = self.closes[previous]
+        current_price = self.closes[cursor]
+
+        change = (current_price - last_price) / last_price * 100
+        rewards = np.stack([-change, change, np.zeros_like(change)], axis=-1)
+
+        # Only the assets closing a neutral streak need their timeline for the streak's low or high
+        for asset in np.flatnonzero(self.neutrality_counter):
+            rewards[asset] = self.timelines[asset].action_rewards(previous, cursor, self.neutrality_counter[asset])
+
+        return rewards
+
+
+    def _reset(self):
+        self.steps = 0
+        self.percent = self.limit_percent
+        self.peak = self.limit_percent
+
+        return time_step.restart(self.get_observation())
+
+
+    def _step(self, action):
+
+        action = np.asarray(action, dtype=np.int64).reshape(len(self.symbols))
+
+        previous = self.cursor
+        self.update_date()
+
+        rewards = self.action_rewards(previous, self.cursor)
+        premi = rewards[np.arange(len(self.symbols)), action]
+
+        if self.neutrality:
+            self.neutrality_counter = np.where(action == 2, self.neutrality_counter + 1, 0)
+
+        # Equal weight on every asset, a neutral one is simply not invested
+        positions = np.select([action == 0, action == 1], [-1., 1.], 0.)
+        premio = float(premi.mean())
+
+        self.percent += premio
+        self.peak = max(self.peak, self.percent)
+
+        self.info = {
+            'rewards': premi.astype(np.float32),
+            'exposure': np.float32(positions.mean()),
+            'gross_exposure': np.float32(np.abs(positions).mean()),
+            'drawdown': np.float32(self.peak - self.percent)
+        }
+
+        self.logger.info(f'Updating observation and reward: {{{premio}}}')
+
+        if self.limit_steps:
+            self.steps += 1
+
+            if self.limit_steps < self.steps:
+
+                if self.cursor + self.limit_steps >= len(self.calendar):
+                    self.seek(0)
+
+                return time_step.termination(self.get_observation(), np.array(premio, dtype=np.float32))
+
+        if self.percent < 0:
+            self.percent = self.limit_percent
+
+            return time_step.termination(self.get_observation(), np.array(premio, dtype=np.float32))
+
+        if self.cursor + 1 >= len(self.calendar):
+            self.seek(0)
+
+            return time_step.termination(self.get_observation(), np.array(premio, dtype=np.float32))
+
+
+        return time_step.transition(self.get_observation(), np.array(premio, dtype=np.float32))
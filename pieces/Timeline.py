@@ -0,0 +1,168 @@
+import numpy as np
+
+from typing import NamedTuple
+
+from prices import PricesClient, feature_windows
+from prices.sessions import TradingCalendar
+from prices.store import COLUMNS
+from prices.features import compute_features
+
+
+CLOSE = COLUMNS.index('close')
+
+
+class EnvState(NamedTuple):
+
+    cursor: int | np.ndarray
+    percent: float | np.ndarray
+    steps: int | np.ndarray
+    neutrality_counter: int | np.ndarray
+    rng: dict
+    extra: object = None
+
+
+class EpisodeTimeline:
+
+    def __init__(self, client:PricesClient,
+                       symbol:str,
+                       calendar:TradingCalendar,
+                       interval_prices:str = '1h',
+                       window:int = 50):
+
+        self.symbol = symbol
+        self.calendar = calendar
+        self.window = window
+
+        # One pass fills the history before the first window and then the whole range
+        client.get_num_bars(symbol, calendar[0], window, interval_prices)
+        client.preload(symbol, calendar[0], calendar[-1], interval_prices)
+
+        self.client = client
+        self.interval_prices = interval_prices
+        self.bar_timestamps, self.bars = client.get_series(symbol, interval_prices)
+
+        # Step i sees the bars up to offsets[i] excluded, its price is the close of the last of them
+        self.offsets = np.searchsorted(self.bar_timestamps, calendar.timestamps, side='right')
+
+        if self.offsets[0] < window:
+            raise ValueError(f'Meno di {window} prezzi di {symbol} prima di {calendar[0]}')
+
+        self.closes = np.asarray(self.bars[self.offsets - 1, CLOSE], dtype=np.float64)
+        self._features = None
+
+        # Sparse tables, level k holds the extremes of every run of 2**k closes
+        self._minima = [self.closes]
+        self._maxima = [self.closes]
+
+        while 2 ** len(self._minima) <= len(self.closes):
+            half = 2 ** (len(self._minima) - 1)
+            self._minima.append(np.minimum(self._minima[-1][:-half], self._minima[-1][half:]))
+            self._maxima.append(np.maximum(self._maxima[-1][:-half], self._maxima[-1][half:]))
+
+
+    def __len__(self):
+
+        return len(self.offsets)
+
+
+    def start_cdf(self, limit_steps:int | None = None, weights = None):
+
+        # Starts late enough to hit the end of the range before limit_steps are excluded
+        count = max(len(self) - (limit_steps or 0) - 1, 1)
+
+        if weights is None:
+            return np.arange(1, count + 1, dtype=np.float64)
+
+        weights = np.asarray(weights(self.calendar.timestamps[:count]), dtype=np.float64)
+
+        if weights.shape != (count,) or (weights < 0).any() or not weights.sum() > 0:
+            raise ValueError(f'I pesi devono essere {count} valori non negativi con somma positiva')
+
+        return np.cumsum(weights)
+
+
+    def sample_start(self, cdf:np.ndarray, rng:np.random.Generator, size:int | None = None):
+
+        cursor = np.searchsorted(cdf, rng.random(size) * cdf[-1], side='right')
+
+        return int(cursor) if size is None else cursor
+
+
+    def prices(self, cursor:int | np.ndarray):
+
+        # A single cursor gives a view, an array of cursors a (n, window, 7) batch
+        return feature_windows(self.bars, self.window)[self.offsets[cursor] - self.window]
+
+
+    def features(self, cursor:int | np.ndarray):
+
+        # Computed once from the same bars the offsets index, a store extended meanwhile cannot shift the rows
+        if self._features is None:
+            self._features = compute_features(self.bars)
+
+        return feature_windows(self._features, self.window)[self.offsets[cursor] - self.window]
+
+
+    def _query(self, table:list, reduce, start:int | np.ndarray, stop:int | np.ndarray):
+
+        # Two overlapping runs of 2**k cover closes[start:stop], which must not be empty
+        if np.ndim(start) == 0 and np.ndim(stop) == 0:
+            k = int(stop - start).bit_length() - 1
+
+            return float(reduce(table[k][start], table[k][stop - (1 << k)]))
+
+        start = np.asarray(start)
+        stop = np.asarray(stop)
+        level = np.log2(stop - start).astype(np.int64)
+
+        out = np.empty(len(start), dtype=np.float64)
+
+        for k in np.unique(level):
+            idx = level == k
+            out[idx] = reduce(table[k][start[idx]], table[k][stop[idx] - 2 ** k])
+
+        return out
+
+
+    def range_min(self, start:int | np.ndarray, stop:int | np.ndarray):
+
+        return self._query(self._minima, np.minimum, start, stop)
+
+
+    def range_max(self, start:int | np.ndarray, stop:int | np.ndarray):
+
+        return self._query(self._maxima, np.maximum, start, stop)
+
+
+    def action_rewards(self, previous:int | np.ndarray, cursor:int | np.ndarray, streak:int | np.ndarray = 0):
+
+        # Rewards of short, long and neutral for moving from previous to cursor, shape (..., 3)
+        scalar = np.ndim(cursor) == 0
+
+        previous = np.atleast_1d(previous)
+        cursor = np.atleast_1d(cursor)
+        streak = np.broadcast_to(streak, cursor.shape)
+
+        last_price = self.closes[previous]
+        current_price = self.closes[cursor]
+
+        change = (current_price - last_price) / last_price * 100
+        rewards = np.stack([-change, change, np.zeros_like(change)], axis=-1)
+
+        # Closing a neutral streak compares the price with the low (short) or high (long) reached during it
+        start = np.maximum(cursor - streak, 0)
+        closing = (streak > 0) & (start < cursor)
+
+        if closing.any():
+
+            extremes = (self.range_min(start[closing], cursor[closing]),
+                        self.range_max(start[closing], cursor[closing]))
+
+            for action, extreme in enumerate(extremes):
+
+                premio = rewards[closing, action]
+                better = extreme <= current_price[closing]
+
+                rewards[closing, action] = premio * np.where(better == (premio < 0), 1.2, 0.8)
+
+        return rewards[0] if scalar else rewards
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import uuid
+import numpy as np
+
+from prices.store import locked, GRACE_SECONDS, LOAD_RETRIES
+
+
+class TokenStore:
+
+    VERSION = 1
+
+    def __init__(self, directory:str, tokenizer:str = 'bert-base-uncased'):
+
+        self.directory = directory
+        self.tokenizer = tokenizer
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._modified = None
+        self._index = None
+        self._tokens = np.empty(0, np.uint16)
+        self._ids = np.empty(0, np.int64)
+        self._urls = np.empty(0, str)
+        self._offsets = np.empty(0, np.int64)
+        self._title_lengths = np.empty(0, np.int32)
+        self._paragraph_lengths = np.empty(0, np.int32)
+        self._rows_by_id = dict()
+        self._rows_by_url = dict()
+
+        self._load()
+
+
+    def _path(self, name:str):
+
+        return os.path.join(self.directory, name)
+
+
+    def _load(self):
+
+        for attempt in range(LOAD_RETRIES):
+
+            meta_path = self._path('meta.json')
+            modified = os.stat(meta_path).st_mtime_ns if os.path.exists(meta_path) else None
+
+            # Another process may have added articles since the store was opened
+            if modified is None or modified == self._modified:
+                return
+
+            # The index meta.json names may be replaced and removed before it is opened, meta.json is read again
+            try:
+                return self._read(meta_path, modified)
+
+            except FileNotFoundError:
+                if attempt == LOAD_RETRIES - 1:
+                    raise
+
+                time.sleep(0.01 * (attempt + 1))
+
+
+    def _read(self, meta_path:str, modified:int):
+
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+
+        if meta['tokenizer'] != self.tokenizer:
+            raise ValueError(f'Lo store e\' stato creato con {meta["tokenizer"]}, non con {self.tokenizer}')
+
+        with np.load(self._path(meta['index'])) as index:
+            self._ids = index['ids']
+            self._offsets = index['offsets']
+            self._title_lengths = index['title_lengths']
+            self._paragraph_lengths = index['paragraph_lengths']
+            self._urls = index['urls']
+
+        # Only the tokens the index commits to, a writer may be appending past them
+        self._tokens = np.memmap(self._path('tokens.bin'), np.uint16, 'r', shape=(meta['tokens'],)) \
+                            if meta['tokens'] else np.empty(0, np.uint16)
+
+        self._rows_by_id = {int(x): row for row, x in enumerate(self._ids)}
+        self._rows_by_url = {str(x): row for row, x in enumerate(self._urls)}
+        self._index = meta['index']
+        self._modified = modified
+
+
+    def __len__(self):
+
+        self._load()
+
+        return len(self._ids)
+
+
+    def __contains__(self, article_id:int):
+
+        self._load()
+
+        return int(article_id) in self._rows_by_id
+
+
+    def add(self, articles:list):
+
+        # Writers take turns, each appends after the tokens the last one committed
+        with locked(self.directory):
+
+            # Read again under the lock, the mtime may not have changed within its resolution
+            self._modified = None
+            self._load()
+            self._add(articles)
+
+
+    def _add(self, articles:list):
+
+        # articles: (id, url, title token ids, first paragraph token ids)
+
+        articles = [x for x in articles if int(x[0]) not in self._rows_by_id]
+
+        if not articles:
+            return
+
+        total = len(self._tokens)
+        chunks = []
+        offsets = []
+        title_lengths = []
+        paragraph_lengths = []
+
+        for _, _, title, paragraph in articles:
+
+            title = np.asarray(title, np.int64)
+            paragraph = np.asarray(paragraph, np.int64)
+
+            if (title > np.iinfo(np.uint16).max).any() or (paragraph > np.iinfo(np.uint16).max).any():
+                raise ValueError('Il vocabolario non entra in uint16')
+
+            offsets.append(total + sum(len(x) for x in chunks))
+            title_lengths.append(len(title))
+            paragraph_lengths.append(len(paragraph))
+            chunks += [title, paragraph]
+
+        # Tokens are appended after the committed ones, anything a crashed writer left there is overwritten
+        mode = 'r+b' if os.path.exists(self._path('tokens.bin')) else 'wb'
+
+        with open(self._path('tokens.bin'), mode) as file:
+            file.seek(total * 2)
+            file.write(np.concatenate(chunks).astype(np.uint16).tobytes())
+            file.truncate()
+
+        name = f'index.{uuid.uuid4().hex}.npz'
+
+        np.savez(self._path(name),
+                 ids = np.concatenate([self._ids, [int(x[0]) for x in articles]]).astype(np.int64),
+                 urls = np.concatenate([self._urls, [str(x[1]) for x in articles]]),
+                 offsets = np.concatenate([self._offsets, offsets]).astype(np.int64),
+                 title_lengths = np.concatenate([self._title_lengths, title_lengths]).astype(np.int32),
+                 paragraph_lengths = np.concatenate([self._paragraph_lengths, paragraph_lengths]).astype(np.int32))
+
+        tmp = self._path(f'.meta.{uuid.uuid4().hex}.tmp')
+        with open(tmp, 'w') as file:
+            json.dump({
+                'version': self.VERSION,
+                'tokenizer': self.tokenizer,
+                'index': name,
+                'tokens': total + sum(len(x) for x in chunks)
+            }, file)
+
+        os.replace(tmp, self._path('meta.json'))
+
+        # Only the index this write replaced, a reader still about to open it reloads from meta.json
+        if self._index is not None and os.path.exists(self._path(self._index)):
+            os.remove(self._path(self._index))
+
+        for old in os.listdir(self.directory):
+
+            stale = self._path(old)
+
+            if old.startswith('index.') and old != name and time.time() - os.stat(stale).st_mtime > GRACE_SECONDS:
+                os.remove(stale)
+
+        self._load()
+
+
+    def rows(self, keys:list, title_length:int = 100, paragraph_length:int = 512, by:str = 'url'):
+
+        self._load()
+
+        lookup = self._rows_by_url if by == 'url' else self._rows_by_id
+        rows = [lookup.get(str(key) if by == 'url' else int(key)) for key in keys]
+
+        found = np.array([row is not None for row in rows], dtype=bool)
+        titles = np.zeros((len(keys), title_length), np.int32)
+        paragraphs = np.zeros((len(keys), paragraph_length), np.int32)
+
+        # Same layout as the tokenizer path, padding on the left and the last tokens kept
+        for i, row in enumerate(rows):
+
+            if row is None:
+                continue
+
+            start = self._offsets[row]
+            middle = start + self._title_lengths[row]
+            end = middle + self._paragraph_lengths[row]
+
+            count = min(middle - start, title_length)
+            titles[i, title_length - count:] = self._tokens[middle - count:middle]
+
+            count = min(end - middle, paragraph_length)
+            paragraphs[i, paragraph_length - count:] = self._tokens[end - count:end]
+
+        return titles, paragraphs, found
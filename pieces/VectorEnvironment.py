@@ -0,0 +1,226 @@
+import traceback
+import numpy as np
+import multiprocessing as mp
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from gym.spaces import Box, Dict
+
+
+
+def _attach(names:dict, space:Dict, num_envs:int):
+
+    memories = {key: SharedMemory(name=name) for key, name in names.items()}
+    buffers = {key: np.ndarray((num_envs,) + space[key].shape, space[key].dtype, buffer=memories[key].buf)
+                    for key in names}
+
+    return memories, buffers
+
+
+def _worker(index:int, env_fn, pipe, parent_pipe, num_envs:int):
+
+    parent_pipe.close()
+
+    memories = dict()
+
+    try:
+
+        env = env_fn()
+        pipe.send((True, (env.observation_space, env.action_space)))
+
+        memories, buffers = _attach(pipe.recv(), env.observation_space, num_envs)
+
+        def write(observation):
+
+            # Straight into this worker's row, nothing but rewards and flags goes back through the pipe
+            for key, buffer in buffers.items():
+                buffer[index] = observation[key]
+
+        while True:
+
+            command, data = pipe.recv()
+
+            if command == 'reset':
+                write(env.reset())
+                pipe.send((True, None))
+
+            elif command == 'step':
+                observation, reward, done, info = env.step(data)
+
+                if done:
+                    info = dict(info, terminal_observation=observation)
+                    observation = env.reset()
+
+                write(observation)
+                pipe.send((True, (reward, done, info)))
+
+            elif command == 'call':
+                name, args, kwargs = data
+                pipe.send((True, getattr(env, name)(*args, **kwargs)))
+
+            elif command == 'close':
+                pipe.send((True, None))
+                break
+
+    except (KeyboardInterrupt, EOFError):
+        pass
+
+    except Exception:
+        pipe.send((False, traceback.format_exc()))
+
+    finally:
+
+        for memory in memories.values():
+            memory.close()
+
+        pipe.close()
+
+
+class AsyncTradingEnv:
+
+    def __init__(self, env_fns:list,
+                       context:str | None = None,
+                       copy:bool = True):
+
+        ctx = mp.get_context(context)
+
+        self.num_envs = len(env_fns)
+        self.copy = copy
+        self.closed = False
+
+        self.pipes = []
+        self.processes = []
+
+        # Started before the workers so they share it, otherwise each one would unlink the blocks on exit
+        resource_tracker.ensure_running()
+
+        for index, env_fn in enumerate(env_fns):
+
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(target=_worker,
+                                  args=(index, env_fn, child_pipe, parent_pipe, self.num_envs),
+                                  daemon=True)
+
+            process.start()
+            child_pipe.close()
+
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+
+        self.single_observation_space, self.single_action_space = self._receive()[0]
+
+        # One block per observation key, row i belongs to worker i
+        self.memories = {
+            key: SharedMemory(create=True,
+                              size=max(int(np.prod(box.shape)) * np.dtype(box.dtype).itemsize * self.num_envs, 1))
+                for key, box in self.single_observation_space.spaces.items()
+        }
+
+        self.buffers = {
+            key: np.ndarray((self.num_envs,) + box.shape, box.dtype, buffer=self.memories[key].buf)
+                for key, box in self.single_observation_space.spaces.items()
+        }
+
+        self.observation_space = Dict({
+            key: Box(low=np.broadcast_to(box.low, (self.num_envs,) + box.shape),
+                     high=np.broadcast_to(box.high, (self.num_envs,) + box.shape),
+                     dtype=box.dtype)
+                for key, box in self.single_observation_space.spaces.items()
+        })
+
+        for pipe in self.pipes:
+            pipe.send({key: memory.name for key, memory in self.memories.items()})
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+    def _receive(self):
+
+        results = [pipe.recv() for pipe in self.pipes]
+        errors = [payload for success, payload in results if not success]
+
+        if errors:
+            self.close(terminate=True)
+            raise RuntimeError(f'Errore in un processo dell\'ambiente:\n{errors[0]}')
+
+        return [payload for _, payload in results]
+
+
+    def _observations(self):
+
+        return {key: buffer.copy() if self.copy else buffer for key, buffer in self.buffers.items()}
+
+
+    def reset(self):
+
+        for pipe in self.pipes:
+            pipe.send(('reset', None))
+
+        self._receive()
+
+        return self._observations()
+
+
+    def step_async(self, actions:np.ndarray):
+
+        for pipe, action in zip(self.pipes, np.asarray(actions)):
+            pipe.send(('step', action))
+
+
+    def step_wait(self):
+
+        rewards, dones, infos = zip(*self._receive())
+
+        return (self._observations(),
+                np.array(rewards, dtype=np.float32),
+                np.array(dones, dtype=bool),
+                list(infos))
+
+
+    def step(self, actions:np.ndarray):
+
+        self.step_async(actions)
+
+        return self.step_wait()
+
+
+    def call(self, name:str, *args, **kwargs):
+
+        for pipe in self.pipes:
+            pipe.send(('call', (name, args, kwargs)))
+
+        return self._receive()
+
+
+    def close(self, terminate:bool = False):
+
+        if self.closed:
+            return
+
+        self.closed = True
+
+        if not terminate:
+            for pipe, process in zip(self.pipes, self.processes):
+                if process.is_alive():
+                    pipe.send(('close', None))
+                    pipe.recv()
+
+        for pipe, process in zip(self.pipes, self.processes):
+
+            if terminate and process.is_alive():
+                process.terminate()
+
+            process.join()
+            pipe.close()
+
+        for memory in getattr(self, 'memories', dict()).values():
+            memory.close()
+            memory.unlink()
@@ -2,14 +2,26 @@ try:
 
   from Environment import TradingEnv
   from GymEnvironment import TradingEnv
+  from BatchedEnvironment import BatchedTradingEnv
+  from PortfolioEnvironment import PortfolioTradingEnv
+  from VectorEnvironment import AsyncTradingEnv
+  from Backtest import Backtester
   from Metric import TradingMetric
   from Observation import Observer
+  from Cache import ObservationCache
+  from Tokens import TokenStore
   from Net import TradingNet
 
 except Exception:
 
   from pieces.Environment import TradingEnv
   from pieces.GymEnvironment import TradingEnv
+  from pieces.BatchedEnvironment import BatchedTradingEnv
+  from pieces.PortfolioEnvironment import PortfolioTradingEnv
+  from pieces.VectorEnvironment import AsyncTradingEnv
+  from pieces.Backtest import Backtester
   from pieces.Metric import TradingMetric
   from pieces.Observation import Observer
+  from pieces.Cache import ObservationCache
+  from pieces.Tokens import TokenStore
   from pieces.Net import TradingNet
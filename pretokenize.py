@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pieces'))
+
+from transformers import AutoTokenizer
+from news import GetNews
+from Tokens import TokenStore
+
+
+def load_articles(cache_dir:str, symbols:list | None = None):
+
+    articles = dict()
+
+    # The article lists backfill.py --news wrote, one file per symbol and window
+    for path in sorted(glob.glob(os.path.join(cache_dir, 'news', '*', '*.json'))):
+
+        if symbols and os.path.basename(os.path.dirname(path)) not in symbols:
+            continue
+
+        with open(path, 'r') as file:
+            for article in json.load(file):
+                articles.setdefault(int(article['id']), article)
+
+    return articles
+
+
+def tokenize(tokenizer, items:list, max_length:int = 512):
+
+    # Same texts and truncation as tokenize_news, but unpadded: the store keeps every row at its own length
+    texts = [item.get('title') or '' for item in items] + \
+                [item['paragraphs'][0] if item.get('paragraphs') else tokenizer.pad_token for item in items]
+
+    ids = tokenizer(texts,
+                    truncation = True,
+                    max_length = max_length,
+                    return_attention_mask = False,
+                    return_token_type_ids = False)['input_ids']
+
+    return ids[:len(items)], ids[len(items):]
+
+
+def pretokenize(options:dict):
+
+    store = TokenStore(os.path.join(options['cache_dir'], 'tokens'), options['tokenizer'])
+    tokenizer = AutoTokenizer.from_pretrained(options['tokenizer'], use_fast=True)
+    rest = GetNews(options['api_key'], options['api_secret'], options['cache_dir'])
+
+    articles = load_articles(options['cache_dir'], options['symbols'])
+    missing = [article for article_id, article in articles.items() if article_id not in store]
+
+    print(f'{len(missing)} articoli da tokenizzare, {len(articles) - len(missing)} gia\' nello store')
+
+    done = 0
+    started = time.perf_counter()
+
+    for start in range(0, len(missing), options['batch']):
+
+        batch = missing[start:start + options['batch']]
+        items = rest.get_news_by_link([article['url'] for article in batch],
+                                      [article['symbols'] for article in batch])
+
+        # The crawl does not keep the order of the links, items are matched back through their url
+        by_url = {item.get('url'): item for item in items}
+        found = [(article, by_url[article['url']]) for article in batch if article['url'] in by_url]
+
+        if not found:
+            continue
+
+        titles, paragraphs = tokenize(tokenizer, [item for _, item in found])
+        store.add([(article['id'], article['url'], title, paragraph)
+                        for (article, _), title, paragraph in zip(found, titles, paragraphs)])
+
+        done += len(found)
+
+        elapsed = time.perf_counter() - started
+        print(f'[{min(start + len(batch), len(missing))}/{len(missing)}] {done / elapsed:.1f} articles/s', flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(f'Completato in {elapsed:.1f}s: {done} articoli, {len(store)} nello store')
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Scarica e tokenizza in anticipo le notizie salvate da backfill.py')
+
+    parser.add_argument('--cache-dir', default='data')
+    parser.add_argument('--symbols', nargs='+')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--api-key', default=os.environ.get('APCA_API_KEY_ID'))
+    parser.add_argument('--api-secret', default=os.environ.get('APCA_API_SECRET_KEY'))
+    parser.add_argument('--batch', type=int, default=200)
+
+    return vars(parser.parse_args())
+
+
+if __name__ == '__main__':
+    pretokenize(parse_args())
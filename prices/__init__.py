@@ -1,20 +1,42 @@
-from alpaca.data.historical import StockHistoricalDataClient
-from alpaca.data.requests import StockBarsRequest
-from alpaca.data.timeframe import TimeFrame, TimeFrameUnit
-from pandas import Timestamp
+from pandas import Timestamp, Series, DataFrame, DatetimeIndex
 from datetime import datetime, timedelta
 import numpy as np
 
+from prices.store import BarStore, COLUMNS, to_ns, index_to_ns, ns_to_index, nearest_index, asof_index
+from prices.backends import Backend, AlpacaBackend, ReplayBackend, SyntheticBackend, parse_interval
+from prices.resample import SPANS, resample_range
+from prices.features import FEATURES, feature_windows
+
+
+CHUNKS = {
+    'm': int(timedelta(days=30).total_seconds() * 1e9),
+    'h': int(timedelta(days=365).total_seconds() * 1e9),
+    'd': int(timedelta(days=365 * 4).total_seconds() * 1e9),
+    'w': int(timedelta(days=365 * 8).total_seconds() * 1e9),
+    'M': int(timedelta(days=365 * 8).total_seconds() * 1e9)
+}
+
+BASE_INTERVAL = '1m'
+
+MAX_LOOKBACK = timedelta(days=365 * 30)
+
+
 class PricesClient:
 
-    def __init__(self, api_key, secret_key):
+    def __init__(self, api_key:str | None = None, 
+                       secret_key:str | None = None, 
+                       cache_dir:str | None = None,
+                       backend:Backend | None = None,
+                       resample:bool = False):
+
+        self._backend = backend if backend is not None else AlpacaBackend(api_key, secret_key)
+        self._store = BarStore(cache_dir, self._backend.source + ('-resampled' if resample else ''))
 
-        self._client = StockHistoricalDataClient(
-            api_key, 
-            secret_key
-        )
+        # When set every interval is built locally from the stored 1 minute bars
+        self.resample = resample
 
-    def get_last_price(self, symbol:str, date:datetime):
+
+    def _last_price_interval(self, date:datetime):
 
         delta = None
 
@@ -30,143 +52,216 @@ class PricesClient:
             delta = timedelta(days=30)
             time_frame = '1M'
 
-        df = self.get_data_prices(
-                symbol,
-                date - delta,
-                date + delta,
-                time_frame
-        )
-
-        df_idx = Timestamp(datetime(date.year, 
-                                         date.month,
-                                         date.day,
-                                         date.hour,
-                                         date.minute,
-                                         date.second,
-                                         date.microsecond), tz='UTC')
-        
-        closest_date = df.index[np.argmin(np.abs(df.index - df_idx))]
-
-        return df.loc[closest_date]
+        return delta, time_frame
+
+
+    def get_last_price(self, symbol:str, date:datetime, asof:bool = False):
+
+        delta, time_frame = self._last_price_interval(date)
+
+        date_ns = to_ns(date)
+        self._ensure(symbol, time_frame, to_ns(date - delta), to_ns(date + delta))
+
+        timestamps, values = self._store.series(symbol, time_frame)
+        idx = asof_index(timestamps, date_ns) if asof else nearest_index(timestamps, date_ns)
+
+        if idx < 0:
+            raise ValueError(f'Nessun prezzo di {symbol} prima di {date}')
+
+        return Series(values[idx], index=COLUMNS, name=Timestamp(int(timestamps[idx]), tz='UTC'))
     
 
-    def get_num_prices(self, symbol:str, date:datetime, num:int, interval:str='1h'):
+    def get_last_prices(self, symbol:str, dates, interval:str | None = None, asof:bool = False):
+
+        dates = DatetimeIndex(dates)
+
+        if interval is None:
 
-        if interval[-1] == 'h':
-            delta = timedelta(days=((int(interval[:-1]) % 24) + 1) * 3)
+            # The finest resolution needed by any of the dates decides the bars used
+            probe = dates[np.argmax((dates.minute != 0) * 2 + (dates.hour != 0))]
+            delta, interval = self._last_price_interval(probe)
+
+        else:
+            delta = timedelta(0)
+
+        dates_ns = index_to_ns(dates)
+        self._ensure(symbol, interval, to_ns(dates.min() - delta), to_ns(dates.max() + delta))
+
+        timestamps, values = self._store.series(symbol, interval)
+        idx = asof_index(timestamps, dates_ns) if asof else nearest_index(timestamps, dates_ns)
+
+        if (idx < 0).any():
+            raise ValueError(f'Nessun prezzo di {symbol} prima di {dates.min()}')
+
+        return DataFrame(values[idx], index=ns_to_index(timestamps[idx]), columns=COLUMNS)
+    
+
+    def _lookback(self, interval:str):
+
+        amount, unit = parse_interval(interval)
+
+        if unit == 'h':
+            delta = timedelta(days=((amount % 24) + 1) * 3)
             
-        elif interval[-1] == 'm':
-            delta = timedelta(hours=((int(interval[:-1]) % 60) + 1) * 3)
+        elif unit == 'm':
+            delta = timedelta(hours=((amount % 60) + 1) * 3)
 
-        elif interval[-1] == 'd':
-            delta = timedelta(days=int(interval[:-1]) * 7)
+        elif unit == 'd':
+            delta = timedelta(days=amount * 7)
 
-        elif interval[-1] == 'M':
-            delta = timedelta(days=int(interval[:-1] * 60))
+        elif unit == 'w':
+            delta = timedelta(days=amount * 7 * 7)
 
         else:
-            raise ValueError(f'Interval: {interval}, not supported, only: %%d, %%m, %%s')
+            delta = timedelta(days=amount * 60)
+
+        return delta
+
+
+    def get_num_bars(self, symbol:str, date:datetime, num:int, interval:str='1h'):
 
+        date_ns = to_ns(date)
+        delta = self._lookback(interval)
 
         while True:
-            
-            df = self.get_delta_prices(
-                symbol,
-                date,
-                delta,
-                interval
-            )
 
-            if len(df) > num:
-                break
+            self._ensure(symbol, interval, to_ns(date - delta), date_ns)
 
-            else:
-                delta += delta
+            timestamps, values = self._store.series(symbol, interval)
+            end = np.searchsorted(timestamps, date_ns, side='right')
 
-        return df[(len(df) - num):]
-    
+            # An older chunk stored earlier may sit behind a range never fetched, the window must be covered
+            if end >= num and not self._store.missing(symbol, interval, int(timestamps[end - num]),
+                                                      min(date_ns, to_ns(Timestamp.now(tz='UTC')))):
+                # Slicing the stored array returns a view, nothing is copied
+                return timestamps[end - num:end], values[end - num:end]
 
-    def get_data_prices(self, symbol:str, date:datetime, end:datetime, interval:str='1h'):
+            if delta > MAX_LOOKBACK:
+                raise ValueError(f'Meno di {num} prezzi di {symbol} prima di {date}')
 
-        if interval[-1] == 'h':
-            time_frame = TimeFrame(int(interval[:-1]), TimeFrameUnit.Hour)
-        
-        elif interval[-1] == 'm':
-            time_frame = TimeFrame(int(interval[:-1]), TimeFrameUnit.Minute)
+            delta += delta
 
-        elif interval[-1] == 'd':
 
-            if int(interval[:-1]) == 1:
-                time_frame = TimeFrame.Day
+    def get_num_features(self, symbol:str, date:datetime, num:int, interval:str='1h'):
 
-            else:
-                time_frame = TimeFrame(int(interval[:-1]) * 24, TimeFrameUnit.Hour)
+        timestamps, _ = self.get_num_bars(symbol, date, num, interval)
 
-        elif interval[-1] == 'M':
-            time_frame = TimeFrame(int(interval[:-1]), TimeFrameUnit.Month)
+        # The bars are cached by now, the window ending at the same bar is a view on the stored features
+        end = np.searchsorted(self._store.series(symbol, interval)[0], to_ns(date), side='right')
 
-        else:
-            raise ValueError(f'Interval: {interval}, not supported, only: %%d, %%m, %%s')
+        return feature_windows(self._store.features(symbol, interval), num)[end - num]
 
-        
-        request = StockBarsRequest(
-            symbol_or_symbols=[symbol],
-            start = date,
-            end = end,
-            timeframe = time_frame
-        )
 
-        df = self._client.get_stock_bars(request).df
+    def get_series(self, symbol:str, interval:str='1h'):
 
-        if len(df.index.names) > 1:
-            df_index = df.reset_index()
-            df_index = df_index.drop(columns=['symbol'])
+        return self._store.series(symbol, interval)
 
-            df_new = df_index.set_index('timestamp')
 
-            return df_new
-        
-        return df
+    def get_features_series(self, symbol:str, interval:str='1h'):
+
+        return self._store.features(symbol, interval)
+
+
+    def get_num_prices(self, symbol:str, date:datetime, num:int, interval:str='1h'):
+
+        timestamps, values = self.get_num_bars(symbol, date, num, interval)
+
+        return DataFrame(values, index=ns_to_index(timestamps), columns=COLUMNS, copy=False)
     
+
+    def preload(self, symbols:str | list, start:datetime, end:datetime, interval:str='1h'):
+
+        self._ensure(symbols, interval, to_ns(start), to_ns(end))
     
-    def get_delta_prices(self, symbol:str, date:datetime, delta:timedelta, interval:str='1h'):
 
-        if interval[-1] == 'h':
-            time_frame = TimeFrame(int(interval[:-1]), TimeFrameUnit.Hour)
-        
-        elif interval[-1] == 'm':
-            time_frame = TimeFrame(int(interval[:-1]), TimeFrameUnit.Minute)
+    def get_data_prices(self, symbol:str, date:datetime, end:datetime, interval:str='1h'):
+
+        start_ns = to_ns(date)
+        end_ns = to_ns(end)
+
+        self._ensure(symbol, interval, start_ns, end_ns)
+
+        return self._store.read(symbol, interval, start_ns, end_ns)
+    
 
-        elif interval[-1] == 'd':
+    def _ensure(self, symbols:str | list, interval:str, start_ns:int, end_ns:int):
 
-            if int(interval[:-1]) == 1:
-                time_frame = TimeFrame.Day
+        amount, unit = parse_interval(interval)
+        symbols = [symbols] if isinstance(symbols, str) else list(symbols)
 
-            else:
-                time_frame = TimeFrame(int(interval[:-1]) * 24, TimeFrameUnit.Hour)
+        # Bars in the future may still change, so they are never requested nor marked as covered
+        chunk = CHUNKS[unit]
+        now_ns = to_ns(Timestamp.now(tz='UTC'))
 
-        elif interval[-1] == 'M':
-            time_frame = TimeFrame(int(interval[:-1]), TimeFrameUnit.Month)
+        # Gaps are widened to whole chunks, so neighbouring lookups are served by the same request
+        start_ns -= start_ns % chunk
+        end_ns = min(end_ns + (-end_ns % chunk), now_ns)
+
+        if self.resample and interval != BASE_INTERVAL:
+            return self._derive(symbols, amount, unit, interval, start_ns, end_ns, now_ns)
+
+        if len(symbols) == 1:
+            windows = self._store.missing(symbols[0], interval, start_ns, end_ns)
 
         else:
-            raise ValueError(f'Interval: {interval}, not supported, only: %%d, %%m, %%s')
+            windows = [(x, min(x + chunk, end_ns)) for x in range(start_ns, end_ns, chunk)]
+
+        # Only the ranges never requested before go to the backend, the rest is read from the store
+        for window_start, window_end in windows:
+
+            gaps = {symbol: self._store.missing(symbol, interval, window_start, window_end) 
+                        for symbol in symbols}
+            missing = [symbol for symbol in symbols if gaps[symbol]]
 
-        
-        request = StockBarsRequest(
-            symbol_or_symbols=[symbol],
-            start = date - delta,
-            end = date,
-            timeframe = time_frame
-        )
+            if not missing:
+                continue
 
-        df = self._client.get_stock_bars(request).df
+            request_start = min(gaps[symbol][0][0] for symbol in missing)
+            request_end = max(gaps[symbol][-1][1] for symbol in missing)
 
-        if len(df.index.names) > 1:
-            df_index = df.reset_index()
-            df_index = df_index.drop(columns=['symbol'])
+            frames = self._backend.fetch(missing, request_start, request_end, interval)
 
-            df_new = df_index.set_index('timestamp')
+            for symbol in missing:
+                self._store.write(symbol, 
+                                  interval, 
+                                  frames.get(symbol, DataFrame()), 
+                                  request_start, 
+                                  min(request_end, now_ns))
+
+
+    def _derive(self, symbols:list, amount:int, unit:str, interval:str, start_ns:int, end_ns:int, now_ns:int):
+
+        span = SPANS[unit] * amount
+        pending = [symbol for symbol in symbols if self._store.missing(symbol, interval, start_ns, end_ns)]
+
+        if not pending:
+            return
+
+        # The source minutes of every symbol are filled together, then each gap is resampled once and memoized
+        self._ensure(pending, BASE_INTERVAL, start_ns - span, end_ns + span)
+
+        for symbol in pending:
+
+            def load(start, end):
+                self._ensure(symbol, BASE_INTERVAL, start, end)
+                return self._store.slice(symbol, BASE_INTERVAL, start, end)
+
+            for gap_start, gap_end in self._store.missing(symbol, interval, start_ns, end_ns):
+
+                bars = resample_range(load, gap_start, gap_end, amount, unit)
+                self._store.write(symbol, interval, bars, gap_start, min(gap_end, now_ns))
+
+
+    def get_multi_bars(self, symbols:list, date:datetime, end:datetime, interval:str='1h'):
+
+        start_ns = to_ns(date)
+        end_ns = to_ns(end)
+
+        self._ensure(symbols, interval, start_ns, end_ns)
+
+        return {symbol: self._store.slice(symbol, interval, start_ns, end_ns) for symbol in symbols}
+    
+
+    def get_delta_prices(self, symbol:str, date:datetime, delta:timedelta, interval:str='1h'):
 
-            return df_new
-        
-        return df
+        return self.get_data_prices(symbol, date - delta, date, interval)
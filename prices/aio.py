@@ -0,0 +1,263 @@
+import time
+import asyncio
+import aiohttp
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+
+from prices import CHUNKS
+from prices.store import BarStore, COLUMNS, to_ns
+from prices.backends import parse_interval
+
+
+FIELDS = {'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close', 'v': 'volume', 'n': 'trade_count', 'vw': 'vwap'}
+
+
+class TokenBucket:
+
+    def __init__(self, rate:float, capacity:int | None = None):
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(int(rate), 1)
+
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self):
+
+        async with self._lock:
+
+            while True:
+
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncPricesClient:
+
+    def __init__(self, api_key:str,
+                       secret_key:str,
+                       cache_dir:str | None = None,
+                       base_url:str = 'https://data.alpaca.markets',
+                       requests_per_minute:int = 200,
+                       connections:int = 10,
+                       session:aiohttp.ClientSession | None = None,
+                       max_retries:int = 5):
+
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'APCA-API-KEY-ID': api_key, 'APCA-API-SECRET-KEY': secret_key}
+
+        self._store = BarStore(cache_dir, 'alpaca')
+        self._limiter = TokenBucket(requests_per_minute / 60, max(requests_per_minute // 60, 1))
+        self._connections = connections
+        self.max_retries = max_retries
+
+        self._session = session
+        self._own_session = session is None
+
+        # Requests already on the wire, identical ones wait for the same result
+        self._inflight = dict()
+
+
+    async def __aenter__(self):
+
+        return self
+
+
+    async def __aexit__(self, *args):
+
+        await self.close()
+
+
+    async def close(self):
+
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+    def _get_session(self):
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit=self._connections),
+                headers = self.headers
+            )
+
+        return self._session
+
+
+    def _time_frame(self, interval:str):
+
+        amount, unit = parse_interval(interval)
+
+        if unit == 'd' and amount != 1:
+            return f'{amount * 24}Hour'
+
+        return f'{amount}' + {'m': 'Min', 'h': 'Hour', 'd': 'Day', 'w': 'Week', 'M': 'Month'}[unit]
+
+
+    async def _get(self, params:dict):
+
+        session = self._get_session()
+
+        for attempt in range(self.max_retries + 1):
+
+            await self._limiter.acquire()
+
+            async with session.get(f'{self.base_url}/v2/stocks/bars', params=params) as response:
+
+                # Once the retries are used up a 429 is raised like any other error status
+                if response.status != 429 or attempt == self.max_retries:
+                    response.raise_for_status()
+
+                    return await response.json()
+
+                delay = float(response.headers.get('Retry-After', 2 ** attempt))
+
+            await asyncio.sleep(delay)
+
+
+    async def _fetch(self, symbols:tuple, start:int, end:int, interval:str):
+
+        params = {
+            'symbols': ','.join(symbols),
+            'timeframe': self._time_frame(interval),
+            'start': pd.Timestamp(start, tz='UTC').isoformat(),
+            'end': pd.Timestamp(end, tz='UTC').isoformat(),
+            'limit': 10000
+        }
+
+        bars = {symbol: [] for symbol in symbols}
+
+        while True:
+
+            page = await self._get(params)
+
+            for symbol, items in (page.get('bars') or dict()).items():
+                bars.setdefault(symbol, []).extend(items)
+
+            if not page.get('next_page_token'):
+                break
+
+            params['page_token'] = page['next_page_token']
+
+        frames = dict()
+
+        for symbol, items in bars.items():
+
+            df = pd.DataFrame(items).rename(columns=FIELDS)
+
+            if df.empty:
+                frames[symbol] = pd.DataFrame(columns=COLUMNS)
+                continue
+
+            df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('t'), utc=True), name='timestamp')
+            frames[symbol] = df.reindex(columns=COLUMNS)
+
+        return frames
+
+
+    async def fetch(self, symbols:list, start:int, end:int, interval:str) -> dict:
+
+        key = (tuple(symbols), interval, start, end)
+
+        if key not in self._inflight:
+
+            task = asyncio.ensure_future(self._fetch(key[0], start, end, interval))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+            self._inflight[key] = task
+
+        # Shielded so a cancelled waiter does not cancel the request for the others
+        return await asyncio.shield(self._inflight[key])
+
+
+    async def _ensure(self, symbols:list, interval:str, start_ns:int, end_ns:int):
+
+        _, unit = parse_interval(interval)
+
+        chunk = CHUNKS[unit]
+        now_ns = to_ns(pd.Timestamp.now(tz='UTC'))
+
+        start_ns -= start_ns % chunk
+        end_ns = min(end_ns + (-end_ns % chunk), now_ns)
+
+        if len(symbols) == 1:
+            windows = self._store.missing(symbols[0], interval, start_ns, end_ns)
+
+        else:
+            windows = [(x, min(x + chunk, end_ns)) for x in range(start_ns, end_ns, chunk)]
+
+        async def fill(window_start, window_end):
+
+            missing = [symbol for symbol in symbols
+                            if self._store.missing(symbol, interval, window_start, window_end)]
+
+            if not missing:
+                return
+
+            frames = await self.fetch(missing, window_start, window_end, interval)
+
+            for symbol in missing:
+                if self._store.missing(symbol, interval, window_start, window_end):
+                    self._store.write(symbol,
+                                      interval,
+                                      frames.get(symbol, pd.DataFrame()),
+                                      window_start,
+                                      min(window_end, now_ns))
+
+        await asyncio.gather(*[fill(window_start, window_end) for window_start, window_end in windows])
+
+
+    async def get_data_prices(self, symbol:str, date:datetime, end:datetime, interval:str='1h'):
+
+        start_ns = to_ns(date)
+        end_ns = to_ns(end)
+
+        await self._ensure([symbol], interval, start_ns, end_ns)
+
+        return self._store.read(symbol, interval, start_ns, end_ns)
+
+
+    async def get_multi_bars(self, symbols:list, date:datetime, end:datetime, interval:str='1h'):
+
+        start_ns = to_ns(date)
+        end_ns = to_ns(end)
+
+        await self._ensure(list(symbols), interval, start_ns, end_ns)
+
+        return {symbol: self._store.slice(symbol, interval, start_ns, end_ns) for symbol in symbols}
+
+
+    async def get_num_bars(self, symbol:str, date:datetime, num:int, interval:str='1h'):
+
+        date_ns = to_ns(date)
+        delta = pd.Timedelta(CHUNKS[parse_interval(interval)[1]])
+
+        while True:
+
+            await self._ensure([symbol], interval, to_ns(date - delta), date_ns)
+
+            timestamps, values = self._store.series(symbol, interval)
+            end = np.searchsorted(timestamps, date_ns, side='right')
+
+            # An older chunk stored earlier may sit behind a range never fetched, the window must be covered
+            if end >= num and not self._store.missing(symbol, interval, int(timestamps[end - num]),
+                                                      min(date_ns, to_ns(pd.Timestamp.now(tz='UTC')))):
+                return timestamps[end - num:end], values[end - num:end]
+
+            if delta > pd.Timedelta(days=365 * 30):
+                raise ValueError(f'Meno di {num} prezzi di {symbol} prima di {date}')
+
+            delta += delta
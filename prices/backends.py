@@ -0,0 +1,333 @@
+import os
+import zlib
+import numpy as np
+import pandas as pd
+import pandas_market_calendars as mcal
+
+from datetime import datetime
+
+from prices.store import COLUMNS, to_ns, index_to_ns, ns_to_index
+from prices.resample import resample_range
+
+try:
+    from alpaca.data.historical import StockHistoricalDataClient
+    from alpaca.data.requests import StockBarsRequest
+    from alpaca.data.timeframe import TimeFrame, TimeFrameUnit
+
+except ImportError:
+    StockHistoricalDataClient = None
+
+
+UNITS = ['m', 'h', 'd', 'w', 'M']
+
+ALIASES = {'wk': 'w', 'mo': 'M'}
+
+
+def parse_interval(interval:str):
+
+    amount = interval.rstrip('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    unit = ALIASES.get(interval[len(amount):], interval[len(amount):])
+
+    if unit not in UNITS or not amount.isdigit() or int(amount) < 1:
+        raise ValueError(f'Interval: {interval}, not supported, only: %%d, %%m, %%s')
+
+    return int(amount), unit
+
+
+class Backend:
+
+    @property
+    def source(self) -> str:
+
+        # Names the bar store directory, bars of different sources are never mixed
+        return type(self).__name__.lower()
+
+
+    def fetch(self, symbols:list, start:int, end:int, interval:str) -> dict:
+
+        raise NotImplementedError
+
+
+class AlpacaBackend(Backend):
+
+    def __init__(self, api_key:str, secret_key:str):
+
+        if StockHistoricalDataClient is None:
+            raise ImportError('AlpacaBackend richiede il pacchetto alpaca-py')
+
+        self._client = StockHistoricalDataClient(
+            api_key,
+            secret_key
+        )
+
+
+    @property
+    def source(self) -> str:
+
+        return 'alpaca'
+
+
+    def _time_frame(self, interval:str):
+
+        amount, unit = parse_interval(interval)
+
+        if unit == 'h':
+            time_frame = TimeFrame(amount, TimeFrameUnit.Hour)
+
+        elif unit == 'm':
+            time_frame = TimeFrame(amount, TimeFrameUnit.Minute)
+
+        elif unit == 'd':
+
+            if amount == 1:
+                time_frame = TimeFrame.Day
+
+            else:
+                time_frame = TimeFrame(amount * 24, TimeFrameUnit.Hour)
+
+        elif unit == 'w':
+            time_frame = TimeFrame(amount, TimeFrameUnit.Week)
+
+        else:
+            time_frame = TimeFrame(amount, TimeFrameUnit.Month)
+
+        return time_frame
+
+
+    def fetch(self, symbols:list, start:int, end:int, interval:str) -> dict:
+
+        request = StockBarsRequest(
+            symbol_or_symbols=symbols,
+            start = pd.Timestamp(start, tz='UTC').to_pydatetime(),
+            end = pd.Timestamp(end, tz='UTC').to_pydatetime(),
+            timeframe = self._time_frame(interval)
+        )
+
+        df = self._client.get_stock_bars(request).df
+
+        if df.empty:
+            return dict()
+
+        if len(df.index.names) > 1:
+
+            return {
+                symbol: group.droplevel('symbol')
+                for symbol, group in df.groupby(level='symbol', sort=False)
+            }
+
+        return {symbols[0]: df}
+
+
+class ReplayBackend(Backend):
+
+    def __init__(self, directory:str, file_format:str = 'parquet'):
+
+        if file_format not in ('parquet', 'csv'):
+            raise ValueError('Formato dev\'essere parquet o csv')
+
+        self.directory = directory
+        self.file_format = file_format
+        self._series = dict()
+
+
+    @property
+    def source(self) -> str:
+
+        # The parquet and csv recordings of a directory may differ, each has its own store
+        return f'replay-{self.file_format}-{zlib.crc32(os.path.abspath(self.directory).encode()):08x}'
+
+
+    def _load(self, symbol:str, interval:str):
+
+        key = (symbol, interval)
+
+        if key not in self._series:
+
+            path = os.path.join(self.directory, symbol, f'{interval}.{self.file_format}')
+
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'Nessuna registrazione di {symbol} a {interval}: {path}')
+
+            if self.file_format == 'parquet':
+                df = pd.read_parquet(path)
+
+            else:
+                df = pd.read_csv(path)
+
+            if 'timestamp' in df.columns:
+                df = df.set_index('timestamp')
+
+            timestamps = index_to_ns(pd.to_datetime(df.index, utc=True))
+            order = np.argsort(timestamps, kind='stable')
+
+            self._series[key] = (timestamps[order], df.reindex(columns=COLUMNS).to_numpy(np.float64)[order])
+
+        return self._series[key]
+
+
+    def fetch(self, symbols:list, start:int, end:int, interval:str) -> dict:
+
+        parse_interval(interval)
+        frames = dict()
+
+        for symbol in symbols:
+
+            timestamps, values = self._load(symbol, interval)
+
+            left = np.searchsorted(timestamps, start, side='left')
+            right = np.searchsorted(timestamps, end, side='right')
+
+            frames[symbol] = pd.DataFrame(values[left:right],
+                                          index=ns_to_index(timestamps[left:right]),
+                                          columns=COLUMNS)
+
+        return frames
+
+
+class SyntheticBackend(Backend):
+
+    def __init__(self, seed:int = 0,
+                       model:str = 'gbm',
+                       origin:datetime = datetime(2015, 1, 1),
+                       price:float = 100.,
+                       drift:float = 0.05,
+                       volatility:float = 0.25,
+                       reversion:float = 5.,
+                       volume:float = 5000.,
+                       exchange:str = 'NASDAQ'):
+
+        if model not in ('gbm', 'ou'):
+            raise ValueError('Modello dev\'essere gbm o ou')
+
+        self.seed = seed
+        self.model = model
+        self.origin = origin
+        self.price = price
+        self.drift = drift
+        self.volatility = volatility
+        self.reversion = reversion
+        self.volume = volume
+        self.exchange = exchange
+        self.calendar = mcal.get_calendar(exchange)
+
+        self._years = dict()
+
+
+    @property
+    def source(self) -> str:
+
+        # Every parameter changes the prices, not only the seed
+        parameters = repr((self.model, self.origin, self.price, self.drift, self.volatility,
+                           self.reversion, self.volume, self.exchange))
+
+        return f'synthetic-{self.seed}-{zlib.crc32(parameters.encode()):08x}'
+
+
+    def _sessions(self, year:int):
+
+        schedule = self.calendar.schedule(datetime(year, 1, 1), datetime(year, 12, 31))
+
+        opens = index_to_ns(pd.DatetimeIndex(schedule['market_open']))
+        closes = index_to_ns(pd.DatetimeIndex(schedule['market_close']))
+
+        minutes = ((closes - opens) // 60_000_000_000).astype(np.int64)
+        offsets = np.arange(minutes.sum()) - np.repeat(np.cumsum(minutes) - minutes, minutes)
+
+        return np.repeat(opens, minutes) + offsets * 60_000_000_000, minutes
+
+
+    def _year(self, symbol:str, year:int):
+
+        key = (symbol, year)
+
+        if key in self._years:
+            return self._years[key]
+
+        # Every year continues from the previous close, so bars never depend on how ranges are requested
+        if year > self.origin.year:
+            last = np.log(self._year(symbol, year - 1)[1][-1, 3])
+
+        else:
+            last = np.log(self.price)
+
+        previous = last
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), year])
+        timestamps, minutes = self._sessions(year)
+
+        dt = 1 / (252 * 390)
+        noise = rng.standard_normal(len(timestamps)) * self.volatility * np.sqrt(dt)
+
+        if self.model == 'gbm':
+            log_close = last + np.cumsum((self.drift - self.volatility ** 2 / 2) * dt + noise)
+
+        else:
+            # Exact AR(1) discretisation of the OU process, solved one session at a time
+            decay = np.exp(-self.reversion * dt)
+            mean = np.log(self.price)
+            log_close = np.empty(len(timestamps))
+
+            start = 0
+            for length in minutes:
+
+                steps = np.arange(1, length + 1)
+                shocks = (1 - decay) * mean + noise[start:start + length]
+
+                log_close[start:start + length] = decay ** steps * (last + np.cumsum(shocks * decay ** -steps))
+                last = log_close[start + length - 1]
+                start += length
+
+        close = np.exp(log_close)
+        open_ = np.exp(np.concatenate([[previous], log_close[:-1]]))
+
+        spread = np.abs(rng.standard_normal((2, len(close)))) * self.volatility * np.sqrt(dt) / 2
+        high = np.maximum(open_, close) * np.exp(spread[0])
+        low = np.minimum(open_, close) * np.exp(-spread[1])
+
+        volume = np.round(rng.lognormal(np.log(self.volume), 0.5, len(close)))
+        trade_count = np.maximum(np.round(volume / 100), 1)
+        vwap = (open_ + high + low + close) / 4
+
+        values = np.column_stack([open_, high, low, close, volume, trade_count, vwap])
+        self._years[key] = (timestamps, values)
+
+        return self._years[key]
+
+
+    def _minutes(self, symbol:str, start:int, end:int):
+
+        first = max(pd.Timestamp(start, tz='UTC').year, self.origin.year)
+        last = pd.Timestamp(end, tz='UTC').year
+
+        if last < first:
+            return np.empty(0, np.int64), np.empty((0, len(COLUMNS)))
+
+        years = [self._year(symbol, year) for year in range(first, last + 1)]
+
+        timestamps = np.concatenate([x[0] for x in years])
+        values = np.concatenate([x[1] for x in years])
+
+        left = np.searchsorted(timestamps, max(start, to_ns(self.origin)), side='left')
+        right = np.searchsorted(timestamps, end, side='right')
+
+        return timestamps[left:right], values[left:right]
+
+
+    def fetch(self, symbols:list, start:int, end:int, interval:str) -> dict:
+
+        amount, unit = parse_interval(interval)
+        frames = dict()
+
+        for symbol in symbols:
+
+            if interval == '1m':
+                timestamps, values = self._minutes(symbol, start, end)
+
+            else:
+                load = lambda x, y: self._minutes(symbol, x, y)
+                timestamps, values = resample_range(load, start, end, amount, unit)
+
+            df = pd.DataFrame(values, index=ns_to_index(timestamps), columns=COLUMNS)
+
+            frames[symbol] = df
+
+        return frames
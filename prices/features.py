@@ -0,0 +1,79 @@
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+FEATURES = ['return', 'log_return', 'volatility', 'rsi', 'volume_z', 'range', 'vwap_gap', 'momentum']
+
+# Same column order as prices.store.COLUMNS
+OPEN, HIGH, LOW, CLOSE, VOLUME, TRADE_COUNT, VWAP = range(7)
+
+
+def rolling_mean(x:np.ndarray, window:int):
+
+    # Prefix sums give every window in one subtraction, the first rows average what is available
+    sums = np.concatenate([[0.], np.cumsum(x, dtype=np.float64)])
+    right = np.arange(1, len(x) + 1)
+    left = np.maximum(right - window, 0)
+
+    return (sums[right] - sums[left]) / (right - left)
+
+
+def rolling_std(x:np.ndarray, window:int):
+
+    mean = rolling_mean(x, window)
+    square = rolling_mean(np.asarray(x, np.float64) ** 2, window)
+
+    return np.sqrt(np.maximum(square - mean ** 2, 0))
+
+
+def compute_features(values:np.ndarray,
+                     rsi_window:int = 14,
+                     volatility_window:int = 20,
+                     volume_window:int = 20,
+                     momentum_window:int = 10):
+
+    out = np.zeros((len(values), len(FEATURES)), np.float32, order='F')
+
+    if len(values) == 0:
+        return out
+
+    close = values[:, CLOSE].astype(np.float64)
+    volume = values[:, VOLUME].astype(np.float64)
+
+    previous = np.concatenate([close[:1], close[:-1]])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        returns = np.where(previous > 0, close / previous - 1, 0)
+        log_returns = np.log1p(returns)
+
+        gains = rolling_mean(np.maximum(returns, 0), rsi_window)
+        losses = rolling_mean(np.maximum(-returns, 0), rsi_window)
+        rsi = np.where(gains + losses > 0, 100 * gains / (gains + losses), 50)
+
+        volume_std = rolling_std(volume, volume_window)
+        volume_z = np.where(volume_std > 0, (volume - rolling_mean(volume, volume_window)) / volume_std, 0)
+
+        price_range = np.where(close > 0, (values[:, HIGH] - values[:, LOW]) / close, 0)
+        vwap_gap = np.where(values[:, VWAP] > 0, close / values[:, VWAP] - 1, 0)
+
+        lagged = np.concatenate([np.repeat(close[:1], momentum_window), close])[:len(close)]
+        momentum = np.where(lagged > 0, close / lagged - 1, 0)
+
+    out[:, 0] = returns
+    out[:, 1] = log_returns
+    out[:, 2] = rolling_std(log_returns, volatility_window)
+    out[:, 3] = rsi
+    out[:, 4] = volume_z
+    out[:, 5] = price_range
+    out[:, 6] = vwap_gap
+    out[:, 7] = momentum
+
+    return out
+
+
+def feature_windows(features:np.ndarray, length:int):
+
+    # (rows - length + 1, length, features) view, window i ends at row i + length - 1
+    return sliding_window_view(features, length, axis=0).transpose(0, 2, 1)
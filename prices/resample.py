@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from prices.store import COLUMNS
+
+
+MINUTE = 60_000_000_000
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Longest possible length of one bucket of each unit, used to widen the source range
+SPANS = {'m': MINUTE, 'h': HOUR, 'd': 2 * DAY, 'w': 8 * DAY, 'M': 32 * DAY}
+
+OPEN, HIGH, LOW, CLOSE, VOLUME, TRADE_COUNT, VWAP = range(len(COLUMNS))
+
+
+def _local_midnights(timestamps:np.ndarray, timezone:str):
+
+    local = pd.DatetimeIndex(timestamps.view('datetime64[ns]')).tz_localize('UTC').tz_convert(timezone)
+
+    return local.normalize()
+
+
+def _to_ns(index:pd.DatetimeIndex):
+
+    return np.asarray(index.tz_convert('UTC').tz_localize(None), dtype='datetime64[ns]').view(np.int64)
+
+
+def bucket_starts(timestamps:np.ndarray, amount:int, unit:str, timezone:str = 'America/New_York'):
+
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    if unit in ('m', 'h'):
+        length = amount * (MINUTE if unit == 'm' else HOUR)
+
+        return timestamps - timestamps % length
+
+    midnights = _local_midnights(timestamps, timezone)
+
+    if unit == 'M':
+        months = (midnights.year - 1970) * 12 + midnights.month - 1
+        months = np.asarray(months - months % amount)
+
+        labels = pd.DatetimeIndex(
+            (months.astype('datetime64[M]')).astype('datetime64[ns]')
+        ).tz_localize(timezone)
+
+        return _to_ns(labels)
+
+    days = np.asarray(midnights.tz_localize(None), dtype='datetime64[D]').view(np.int64)
+
+    if unit == 'w':
+        # Day 0 of the epoch is a Thursday, weeks start on Monday
+        length = 7 * amount
+        days = days - (days + 3) % length
+
+    else:
+        days = days - days % amount
+
+    labels = pd.DatetimeIndex(days.astype('datetime64[D]').astype('datetime64[ns]')).tz_localize(timezone)
+
+    return _to_ns(labels)
+
+
+def resample(timestamps:np.ndarray, values:np.ndarray, amount:int, unit:str, timezone:str = 'America/New_York'):
+
+    if len(timestamps) == 0:
+        return np.empty(0, np.int64), np.empty((0, len(COLUMNS)), values.dtype)
+
+    labels = bucket_starts(timestamps, amount, unit, timezone)
+
+    starts = np.flatnonzero(np.concatenate([[True], labels[1:] != labels[:-1]]))
+    ends = np.concatenate([starts[1:], [len(labels)]])
+
+    out = np.empty((len(starts), len(COLUMNS)), values.dtype)
+
+    out[:, OPEN] = values[starts, OPEN]
+    out[:, HIGH] = np.maximum.reduceat(values[:, HIGH], starts)
+    out[:, LOW] = np.minimum.reduceat(values[:, LOW], starts)
+    out[:, CLOSE] = values[ends - 1, CLOSE]
+    out[:, TRADE_COUNT] = np.add.reduceat(values[:, TRADE_COUNT], starts, dtype=np.float64)
+
+    # Sums are accumulated in float64, stored bars are only float32
+    volume = np.add.reduceat(values[:, VOLUME], starts, dtype=np.float64)
+    out[:, VOLUME] = volume
+
+    # Volume weighted, buckets without volume fall back to the plain mean of their vwaps
+    weighted = np.add.reduceat(values[:, VWAP].astype(np.float64) * values[:, VOLUME], starts)
+    mean = np.add.reduceat(values[:, VWAP], starts, dtype=np.float64) / (ends - starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[:, VWAP] = np.where(volume > 0, weighted / volume, mean)
+
+    return labels[starts], out
+
+
+def resample_range(load, start:int, end:int, amount:int, unit:str, timezone:str = 'America/New_York'):
+
+    # The source is widened by a whole bucket on both sides, so the edge buckets are never partial
+    span = SPANS[unit] * amount
+    timestamps, values = load(start - span, end + span)
+
+    timestamps, values = resample(timestamps, values, amount, unit, timezone)
+
+    first = bucket_starts(np.array([start], np.int64), amount, unit, timezone)[0]
+    keep = (timestamps >= first) & (timestamps <= end)
+
+    return timestamps[keep], values[keep]
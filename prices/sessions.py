@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pandas_market_calendars as mcal
+
+from datetime import datetime, timedelta
+
+from prices.store import to_ns, index_to_ns
+
+
+class TradingCalendar:
+
+    def __init__(self, start:datetime,
+                       end:datetime,
+                       interval:timedelta = timedelta(hours=1),
+                       exchange:str = 'NASDAQ'):
+
+        step = int(interval.total_seconds() * 1e9)
+
+        if step <= 0:
+            raise ValueError('L\'intervallo dev\'essere positivo')
+
+        schedule = mcal.get_calendar(exchange).schedule(
+            (pd.Timestamp(start) - pd.Timedelta(days=1)).date(),
+            (pd.Timestamp(end) + pd.Timedelta(days=1)).date()
+        )
+
+        opens = index_to_ns(pd.DatetimeIndex(schedule['market_open']))
+        closes = index_to_ns(pd.DatetimeIndex(schedule['market_close']))
+        days = index_to_ns(pd.DatetimeIndex(schedule.index))
+
+        day = int(timedelta(days=1).total_seconds() * 1e9)
+        first = np.searchsorted(opens, to_ns(start), side='left')
+
+        if len(opens) == 0 or first == len(opens):
+            timestamps = np.empty(0, np.int64)
+
+        elif step <= (closes - opens).max():
+
+            # Every session contributes open, open + step, ... while the market is still open
+            counts = np.maximum(-((opens - closes) // step), 1)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            timestamps = np.repeat(opens, counts) + offsets * step
+
+        elif step % day == 0:
+
+            # Longer than a session: every step days from the first session, each on the first open from that day on
+            grid = np.arange(days[first], days[-1] + 1, step)
+            picked = np.unique(np.searchsorted(days, grid, side='left'))
+
+            timestamps = opens[picked[picked < len(opens)]]
+
+        else:
+            raise ValueError(f'Un intervallo piu\' lungo di una sessione dev\'essere di giorni interi, non {interval}')
+
+        timestamps = timestamps[(timestamps >= to_ns(start)) & (timestamps <= to_ns(end))]
+
+        if len(timestamps) == 0:
+            raise ValueError(f'Nessuna sessione di {exchange} tra {start} e {end}')
+
+        self.exchange = exchange
+        self.interval = interval
+        self.timestamps = timestamps
+
+
+    def __len__(self):
+
+        return len(self.timestamps)
+
+
+    def __getitem__(self, idx:int) -> datetime:
+
+        # Naive UTC, like the dates the envs always passed to the clients
+        return pd.Timestamp(int(self.timestamps[idx])).to_pydatetime()
+
+
+    def index(self, date:datetime) -> int:
+
+        return int(np.searchsorted(self.timestamps, to_ns(date), side='left'))
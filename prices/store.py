@@ -0,0 +1,396 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import numpy as np
+import pandas as pd
+
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+
+except ImportError:
+    fcntl = None
+
+from prices.features import FEATURES, compute_features
+
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap']
+
+# Generations left behind by a writer that died before its swap are removed after this long
+GRACE_SECONDS = 3600
+LOAD_RETRIES = 10
+
+
+def to_ns(date:datetime | pd.Timestamp) -> int:
+
+    ts = pd.Timestamp(date)
+    ts = ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+    return ts.value
+
+
+def index_to_ns(index:pd.Index) -> np.ndarray:
+
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+
+    return np.asarray(index, dtype='datetime64[ns]').view(np.int64)
+
+
+def ns_to_index(timestamps:np.ndarray) -> pd.DatetimeIndex:
+
+    index = pd.DatetimeIndex(np.asarray(timestamps, dtype=np.int64).view('datetime64[ns]'))
+
+    return index.tz_localize('UTC').rename('timestamp')
+
+
+def frame_to_arrays(df:pd.DataFrame):
+
+    if df.empty:
+        return np.empty(0, np.int64), np.empty((0, len(COLUMNS)), np.float32)
+
+    timestamps = index_to_ns(df.index)
+    values = df.reindex(columns=COLUMNS).to_numpy(np.float32)
+
+    return timestamps, values
+
+
+def nearest_index(timestamps:np.ndarray, targets) -> np.ndarray:
+
+    targets = np.asarray(targets, dtype=np.int64)
+
+    if len(timestamps) == 0:
+        raise ValueError('Nessun prezzo disponibile')
+
+    position = np.searchsorted(timestamps, targets, side='left')
+    left = np.clip(position - 1, 0, len(timestamps) - 1)
+    right = np.clip(position, 0, len(timestamps) - 1)
+
+    # On ties the earlier bar wins, like np.argmin over the distances
+    use_right = np.abs(timestamps[right] - targets) < np.abs(targets - timestamps[left])
+
+    return np.where(use_right, right, left)
+
+
+def asof_index(timestamps:np.ndarray, targets) -> np.ndarray:
+
+    targets = np.asarray(targets, dtype=np.int64)
+
+    return np.searchsorted(timestamps, targets, side='right') - 1
+
+
+class Coverage:
+
+    def __init__(self, ranges:list | None = None):
+
+        self.ranges = [tuple(x) for x in ranges] if ranges else []
+
+    def missing(self, start:int, end:int) -> list:
+
+        gaps = []
+
+        for covered_start, covered_end in self.ranges:
+
+            if covered_end < start:
+                continue
+
+            if covered_start > end:
+                break
+
+            if covered_start > start:
+                gaps.append((start, covered_start))
+
+            start = max(start, covered_end)
+
+        if start < end:
+            gaps.append((start, end))
+
+        return gaps
+
+    def add(self, start:int, end:int):
+
+        if start >= end:
+            return
+
+        ranges = []
+
+        for covered_start, covered_end in self.ranges:
+
+            if covered_end < start or covered_start > end:
+                ranges.append((covered_start, covered_end))
+
+            else:
+                start = min(start, covered_start)
+                end = max(end, covered_end)
+
+        ranges.append((start, end))
+        self.ranges = sorted(ranges)
+
+
+@contextmanager
+def locked(path:str | None):
+
+    # Writers of the same series take turns, readers never wait
+    if path is None or fcntl is None:
+        yield
+        return
+
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, '.lock'), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class BarStore:
+
+    VERSION = 2
+
+    def __init__(self, root:str | None = None, source:str | None = None):
+
+        # Each source gets its own directory, so a synthetic or resampled series never extends a real one
+        self.root = os.path.join(root, source) if root is not None and source is not None else root
+        self.source = source
+        self._series = dict()
+        self._features = dict()
+
+        if self.root is not None:
+            os.makedirs(self.root, exist_ok=True)
+
+
+    def _path(self, symbol:str, interval:str):
+
+        return os.path.join(self.root, symbol, interval)
+
+
+    def _modified(self, symbol:str, interval:str):
+
+        try:
+            return os.stat(os.path.join(self._path(symbol, interval), 'meta.json')).st_mtime_ns
+
+        except FileNotFoundError:
+            return None
+
+
+    def _load(self, symbol:str, interval:str):
+
+        key = (symbol, interval)
+
+        for attempt in range(LOAD_RETRIES):
+
+            modified = self._modified(symbol, interval) if self.root is not None else None
+
+            # Another process may have extended the store since it was opened
+            if key in self._series and self._series[key][3] == modified:
+                return self._series[key][:3]
+
+            # The generation meta.json names may be replaced and removed before it is opened, meta.json is read again
+            try:
+                self._series[key] = self._read(symbol, interval, modified)
+                return self._series[key][:3]
+
+            except FileNotFoundError:
+                if attempt == LOAD_RETRIES - 1:
+                    raise
+
+                time.sleep(0.01 * (attempt + 1))
+
+
+    def _read(self, symbol:str, interval:str, modified:int | None):
+
+        timestamps = np.empty(0, np.int64)
+        values = np.empty((0, len(COLUMNS)), np.float32, order='F')
+        coverage = Coverage()
+        data_path = None
+
+        if modified is not None:
+            path = self._path(symbol, interval)
+
+            with open(os.path.join(path, 'meta.json'), 'r') as file:
+                meta = json.load(file)
+
+            # Stores written with an older layout are simply rebuilt
+            if meta.get('version') == self.VERSION:
+
+                data_path = os.path.join(path, meta['generation'])
+                mmap_mode = 'r' if meta['rows'] else None
+
+                coverage = Coverage(meta['coverage'])
+                timestamps = np.load(os.path.join(data_path, 'timestamp.npy'), mmap_mode=mmap_mode)
+                values = np.load(os.path.join(data_path, 'bars.npy'), mmap_mode=mmap_mode)
+
+        return timestamps, values, coverage, modified, data_path
+
+
+    def _save(self, symbol:str, interval:str):
+
+        if self.root is None:
+            return
+
+        timestamps, values, coverage, _, _ = self._series[(symbol, interval)]
+
+        path = self._path(symbol, interval)
+        previous = self._generation(path)
+        generation = uuid.uuid4().hex
+        data_path = os.path.join(path, generation)
+        os.makedirs(data_path)
+
+        # Every write goes to a fresh directory, readers keep their mapping of the previous one
+        np.save(os.path.join(data_path, 'timestamp.npy'), timestamps)
+        np.save(os.path.join(data_path, 'bars.npy'), values)
+
+        tmp = os.path.join(path, f'.meta.{generation}.tmp')
+        with open(tmp, 'w') as file:
+            json.dump({
+                'version': self.VERSION,
+                'columns': COLUMNS,
+                'generation': generation,
+                'rows': len(timestamps),
+                'coverage': coverage.ranges
+            }, file)
+
+        os.replace(tmp, os.path.join(path, 'meta.json'))
+
+        # Only the generation this write replaced, a reader still holding it reloads from meta.json
+        if previous is not None:
+            shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+        for name in os.listdir(path):
+
+            stale = os.path.join(path, name)
+
+            if name != generation and os.path.isdir(stale) and time.time() - os.stat(stale).st_mtime > GRACE_SECONDS:
+                shutil.rmtree(stale, ignore_errors=True)
+
+        self._series.pop((symbol, interval))
+        self._load(symbol, interval)
+
+
+    def _generation(self, path:str):
+
+        try:
+            with open(os.path.join(path, 'meta.json'), 'r') as file:
+                return json.load(file).get('generation')
+
+        except FileNotFoundError:
+            return None
+
+
+    def series(self, symbol:str, interval:str):
+
+        timestamps, values, _ = self._load(symbol, interval)
+
+        return timestamps, values
+
+
+    def features(self, symbol:str, interval:str):
+
+        timestamps, values, _ = self._load(symbol, interval)
+        data_path = self._series[(symbol, interval)][4]
+
+        key = (symbol, interval)
+        cached = self._features.get(key)
+
+        if cached is not None and cached[0] is timestamps:
+            return cached[1]
+
+        features = None
+        path = os.path.join(data_path, 'features.npy') if data_path is not None else None
+
+        # Features are computed once per version of the bars and saved next to them
+        if path is not None and os.path.exists(path):
+
+            try:
+                features = np.load(path, mmap_mode='r' if len(timestamps) else None)
+
+                if features.shape != (len(timestamps), len(FEATURES)):
+                    features = None
+
+            except FileNotFoundError:
+                features = None
+
+        if features is None:
+            features = compute_features(values)
+
+            # The generation may have been replaced meanwhile, the features are then simply not kept
+            if path is not None:
+                try:
+                    tmp = os.path.join(data_path, f'.features.{uuid.uuid4().hex}.tmp.npy')
+                    np.save(tmp, features)
+                    os.replace(tmp, path)
+
+                except FileNotFoundError:
+                    pass
+
+        self._features[key] = (timestamps, features)
+
+        return features
+
+
+    def missing(self, symbol:str, interval:str, start:int, end:int) -> list:
+
+        return self._load(symbol, interval)[2].missing(start, end)
+
+
+    def write(self, symbol:str, interval:str, data:pd.DataFrame | tuple, start:int, end:int):
+
+        if self.root is None:
+            return self._write(symbol, interval, data, start, end)
+
+        with locked(self._path(symbol, interval)):
+
+            # Read again under the lock, so rows and coverage another writer just published are kept
+            self._series.pop((symbol, interval), None)
+            self._write(symbol, interval, data, start, end)
+
+
+    def _write(self, symbol:str, interval:str, data:pd.DataFrame | tuple, start:int, end:int):
+
+        old_timestamps, old_values, coverage = self._load(symbol, interval)
+        new_timestamps, new_values = data if isinstance(data, tuple) else frame_to_arrays(data)
+
+        # New rows come first so they win over stale rows with the same timestamp
+        timestamps = np.concatenate([new_timestamps, old_timestamps])
+        values = np.concatenate([new_values, old_values])
+
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        values = values[order]
+
+        keep = np.ones(len(timestamps), dtype=bool)
+        keep[1:] = timestamps[1:] != timestamps[:-1]
+
+        coverage.add(start, end)
+
+        # Columns stay contiguous on their own while a run of rows is still a plain view
+        values = np.asfortranarray(values[keep], dtype=np.float32)
+
+        self._series[(symbol, interval)] = (timestamps[keep], values, coverage, None, None)
+        self._save(symbol, interval)
+
+
+    def slice(self, symbol:str, interval:str, start:int, end:int):
+
+        timestamps, values, _ = self._load(symbol, interval)
+
+        left = np.searchsorted(timestamps, start, side='left')
+        right = np.searchsorted(timestamps, end, side='right')
+
+        return timestamps[left:right], values[left:right]
+
+
+    def read(self, symbol:str, interval:str, start:int, end:int) -> pd.DataFrame:
+
+        timestamps, values = self.slice(symbol, interval, start, end)
+
+        return pd.DataFrame(values, index=ns_to_index(timestamps), columns=COLUMNS)
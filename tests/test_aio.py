@@ -0,0 +1,163 @@
+import time
+import asyncio
+import pandas as pd
+
+from aiohttp import web, ClientResponseError
+from aiohttp.test_utils import TestServer
+
+from prices.aio import AsyncPricesClient, TokenBucket
+from prices.store import to_ns
+
+
+START = to_ns(pd.Timestamp('2021-01-04 14:00', tz='UTC'))
+END = to_ns(pd.Timestamp('2021-01-05 14:00', tz='UTC'))
+
+
+def bar(hour:int):
+
+    timestamp = pd.Timestamp('2021-01-04 14:00', tz='UTC') + pd.Timedelta(hours=hour)
+
+    return {'t': timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'o': hour, 'h': hour + 1, 'l': hour - 1, 'c': hour + .5, 'v': 100, 'n': 10, 'vw': hour}
+
+
+class Server:
+
+    # Imitates /v2/stocks/bars: pages of page_size bars chained by next_page_token, 429 on demand
+    def __init__(self, bars:int = 6, page_size:int = 2, delay:float = 0., throttled:int = 0, retry_after:float = 0.):
+
+        self.bars = bars
+        self.page_size = page_size
+        self.delay = delay
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+        self.hits = []
+
+
+    async def handler(self, request:web.Request):
+
+        self.hits.append((time.monotonic(), dict(request.query)))
+
+        if self.throttled:
+            self.throttled -= 1
+            return web.json_response({'message': 'too many requests'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+
+        await asyncio.sleep(self.delay)
+
+        first = int(request.query.get('page_token', 0))
+        last = min(first + self.page_size, self.bars)
+
+        return web.json_response({
+            'bars': {symbol: [bar(x) for x in range(first, last)] for symbol in request.query['symbols'].split(',')},
+            'next_page_token': str(last) if last < self.bars else None
+        })
+
+
+async def serve(server:Server, test, **options):
+
+    app = web.Application()
+    app.router.add_get('/v2/stocks/bars', server.handler)
+
+    http = TestServer(app)
+    await http.start_server()
+
+    try:
+        async with AsyncPricesClient('key', 'secret', base_url=str(http.make_url('')), **options) as client:
+            return await test(client)
+
+    finally:
+        await http.close()
+
+
+def test_identical_requests_share_one_hit():
+
+    server = Server(bars=2, page_size=2, delay=.2)
+
+    async def test(client):
+        return await asyncio.gather(*[client.fetch(['AAPL'], START, END, '1h') for _ in range(10)])
+
+    results = asyncio.run(serve(server, test, requests_per_minute=6000))
+
+    assert len(server.hits) == 1
+    assert all(result['AAPL'].equals(results[0]['AAPL']) for result in results)
+
+
+def test_pages_are_concatenated_in_order():
+
+    server = Server(bars=7, page_size=3)
+
+    async def test(client):
+        return await client.fetch(['AAPL', 'MSFT'], START, END, '1h')
+
+    frames = asyncio.run(serve(server, test, requests_per_minute=6000))
+
+    assert [hit[1].get('page_token') for hit in server.hits] == [None, '3', '6']
+
+    for symbol in ('AAPL', 'MSFT'):
+        assert frames[symbol]['open'].tolist() == list(range(7))
+        assert frames[symbol].index.is_monotonic_increasing
+
+
+def test_throttled_request_waits_retry_after():
+
+    server = Server(bars=2, throttled=1, retry_after=.5)
+
+    async def test(client):
+        return await client.fetch(['AAPL'], START, END, '1h')
+
+    frames = asyncio.run(serve(server, test, requests_per_minute=6000))
+
+    assert len(server.hits) == 2
+    assert server.hits[1][0] - server.hits[0][0] >= .5
+    assert len(frames['AAPL']) == 2
+
+
+def test_throttling_that_never_ends_raises():
+
+    server = Server(bars=2, throttled=100, retry_after=.05)
+
+    async def test(client):
+        return await asyncio.gather(*[client.fetch(['AAPL'], START, END, '1h') for _ in range(3)],
+                                    return_exceptions=True)
+
+    results = asyncio.run(serve(server, test, requests_per_minute=6000, max_retries=2))
+
+    # One request and two retries, every waiter of the shared request gets the error
+    assert len(server.hits) == 3
+    assert all(isinstance(result, ClientResponseError) and result.status == 429 for result in results)
+
+
+def test_token_bucket_caps_request_rate():
+
+    server = Server(bars=1)
+
+    # 20 requests per second with a burst of 20, the other 20 distinct requests need about a second more
+    async def test(client):
+        await asyncio.gather(*[client.fetch(['AAPL'], START + x, END, '1h') for x in range(40)])
+
+    asyncio.run(serve(server, test, requests_per_minute=1200))
+
+    times = sorted(hit[0] for hit in server.hits)
+
+    assert len(times) == 40
+    assert times[-1] - times[0] >= .9
+
+    # Any half second holds at most the burst plus half a second of refill
+    assert all(sum(start <= x <= start + .5 for x in times) <= 20 + 10 + 1 for start in times)
+
+
+def test_token_bucket_refills_at_rate():
+
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def test():
+        started = time.monotonic()
+
+        for _ in range(11):
+            await bucket.acquire()
+
+        return time.monotonic() - started
+
+    assert asyncio.run(test()) >= .45
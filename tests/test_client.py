@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+
+from prices import PricesClient, SyntheticBackend, ReplayBackend
+from prices.store import to_ns
+
+
+def test_num_bars_do_not_span_a_range_never_fetched(tmp_path):
+
+    client = PricesClient(cache_dir=str(tmp_path), backend=SyntheticBackend(seed=0))
+
+    # An older chunk first, then a window whose history before its own chunk was never asked for
+    client.get_data_prices('AAPL', datetime(2019, 3, 1), datetime(2019, 3, 10))
+    timestamps, values = client.get_num_bars('AAPL', datetime(2020, 12, 27), 50, '1h')
+
+    assert len(timestamps) == len(values) == 50
+    assert timestamps[-1] <= to_ns(datetime(2020, 12, 27))
+    assert client._store.missing('AAPL', '1h', int(timestamps[0]), to_ns(datetime(2020, 12, 27))) == []
+
+    # 50 hourly bars are about a week and a half of sessions, nothing from 2019 or the months between
+    assert pd.Timestamp(int(timestamps[0])) > pd.Timestamp('2020-12-01')
+    assert np.all(np.diff(timestamps) > 0)
+
+
+def test_replay_formats_have_their_own_store(tmp_path):
+
+    parquet = PricesClient(cache_dir=str(tmp_path), backend=ReplayBackend(str(tmp_path / 'recordings'), 'parquet'))
+    csv = PricesClient(cache_dir=str(tmp_path), backend=ReplayBackend(str(tmp_path / 'recordings'), 'csv'))
+
+    assert parquet._store.root != csv._store.root
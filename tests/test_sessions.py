@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datetime import datetime, timedelta
+
+from prices.sessions import TradingCalendar
+
+
+def dates(calendar:TradingCalendar):
+
+    return [pd.Timestamp(int(x)).date() for x in calendar.timestamps]
+
+
+def test_hourly_decisions_stay_inside_sessions():
+
+    calendar = TradingCalendar(datetime(2021, 3, 1), datetime(2021, 3, 6), timedelta(hours=1))
+
+    # Five sessions of 6.5 hours, decisions at the open and every hour after it
+    assert len(calendar) == 5 * 7
+    assert len(set(dates(calendar))) == 5
+
+
+def test_daily_decisions_one_per_session():
+
+    # March 31 opens after the end, at midnight
+    calendar = TradingCalendar(datetime(2021, 3, 1), datetime(2021, 3, 31), timedelta(days=1))
+
+    assert len(calendar) == 22
+    assert len(set(dates(calendar))) == 22
+
+
+def test_weekly_decisions_are_a_week_apart():
+
+    calendar = TradingCalendar(datetime(2021, 3, 1), datetime(2021, 5, 1), timedelta(days=7))
+    gaps = np.diff([pd.Timestamp(x) for x in dates(calendar)])
+
+    assert len(calendar) == 9
+    assert all(gap == pd.Timedelta(days=7) for gap in gaps)
+
+
+def test_holiday_moves_to_the_next_session():
+
+    # Good Friday 2021-04-02 is closed, the weekly decision falls on Monday 04-05
+    calendar = TradingCalendar(datetime(2021, 3, 26), datetime(2021, 4, 20), timedelta(days=7))
+
+    assert [str(x) for x in dates(calendar)] == ['2021-03-26', '2021-04-05', '2021-04-09', '2021-04-16']
+
+
+def test_longer_than_a_session_but_not_whole_days_is_rejected():
+
+    with pytest.raises(ValueError):
+        TradingCalendar(datetime(2021, 3, 1), datetime(2021, 3, 31), timedelta(hours=8))
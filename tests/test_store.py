@@ -0,0 +1,99 @@
+import numpy as np
+import multiprocessing as mp
+
+from datetime import datetime
+
+from prices import PricesClient, SyntheticBackend
+from prices.store import BarStore, COLUMNS
+
+
+HOUR = 3600 * 10 ** 9
+
+
+def rows(hours:list, value:float = 1.):
+
+    timestamps = np.array(hours, dtype=np.int64) * HOUR
+    values = np.full((len(hours), len(COLUMNS)), value, dtype=np.float32)
+
+    return timestamps, values
+
+
+def check_merge(store:BarStore):
+
+    store.write('AAPL', '1h', rows([0, 1, 2]), 0, 3 * HOUR)
+    store.write('AAPL', '1h', rows([5, 6]), 5 * HOUR, 7 * HOUR)
+    store.write('AAPL', '1h', rows([2, 3], 2.), 2 * HOUR, 4 * HOUR)
+
+    timestamps, values = store.series('AAPL', '1h')
+
+    assert (timestamps // HOUR).tolist() == [0, 1, 2, 3, 5, 6]
+    assert values[:, 0].tolist() == [1, 1, 2, 2, 1, 1]
+    assert store.missing('AAPL', '1h', 0, 7 * HOUR) == [(4 * HOUR, 5 * HOUR)]
+
+
+def test_memory_store_merges_writes():
+
+    check_merge(BarStore())
+
+
+def test_disk_store_merges_writes(tmp_path):
+
+    check_merge(BarStore(str(tmp_path), 'test'))
+
+    reopened = BarStore(str(tmp_path), 'test')
+
+    assert (reopened.series('AAPL', '1h')[0] // HOUR).tolist() == [0, 1, 2, 3, 5, 6]
+    assert reopened.missing('AAPL', '1h', 0, 7 * HOUR) == [(4 * HOUR, 5 * HOUR)]
+    assert reopened.features('AAPL', '1h').shape[0] == 6
+
+
+class CountingBackend(SyntheticBackend):
+
+    def __init__(self):
+
+        super().__init__(seed=0)
+        self.calls = 0
+
+
+    def fetch(self, symbols:list, start:int, end:int, interval:str) -> dict:
+
+        self.calls += 1
+
+        return super().fetch(symbols, start, end, interval)
+
+
+def test_memory_client_serves_fetched_ranges():
+
+    backend = CountingBackend()
+    client = PricesClient(backend=backend)
+
+    for _ in range(3):
+        client.get_data_prices('AAPL', datetime(2020, 3, 2), datetime(2020, 3, 6))
+        client.get_data_prices('AAPL', datetime(2022, 6, 1), datetime(2022, 6, 3))
+
+    assert backend.calls == 2
+
+
+def write_hours(root:str, first:int):
+
+    store = BarStore(root, 'test')
+
+    for hour in range(first, first + 40, 2):
+        store.write('AAPL', '1h', rows([hour]), hour * HOUR, (hour + 1) * HOUR)
+
+
+def test_concurrent_writers_keep_every_row(tmp_path):
+
+    processes = [mp.get_context('fork').Process(target=write_hours, args=(str(tmp_path), first)) for first in (0, 1)]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    store = BarStore(str(tmp_path), 'test')
+
+    assert [process.exitcode for process in processes] == [0, 0]
+    assert (store.series('AAPL', '1h')[0] // HOUR).tolist() == list(range(40))
+    assert store.missing('AAPL', '1h', 0, 40 * HOUR) == []
@@ -10,7 +10,7 @@ from tf_agents.policies.tf_policy import TFPolicy
 
 from datetime import datetime
 
-from pieces import TradingEnv, TradingNet, TradingMetric
+from pieces import TradingEnv, TradingNet, TradingMetric, Backtester
 
 
 initial_collect_steps = 50
@@ -25,15 +25,15 @@ name = 'model'
 API_KEY = 'API_KEY'
 API_SECRET = 'API_SECRET'
 
-env = TradingEnv(
+py_env = TradingEnv(
     API_KEY,
     API_SECRET,
     datetime(2017, 1, 1),
     datetime(2024, 1, 1),
     'AAPL'
 )
-vocab_size = env.get_tokenizer().vocab_size
-env = GymWrapper(env)
+vocab_size = py_env.get_tokenizer().vocab_size
+env = GymWrapper(py_env)
 env = TFPyEnvironment(env)
 
 q_net = TradingNet(
@@ -134,3 +134,7 @@ for _ in range(num_iterations):
         returns.append(avg_return)
         steps.append(avg_step)
 
+# Greedy policy over the whole range in large batches, instead of one TFPyEnvironment step at a time
+backtest = Backtester(py_env).run(q_net)
+print(Backtester.summary(backtest))
+